@@ -131,9 +131,9 @@ class drifterPropagate():
             # randomly sample one of the seeds to use as the true position
             drifter_index = np.random.choice(choices,size=1)[0]
             if not hasattr(self, 'history'):
-                self.history = self.omodel.history[drifter_index,:]
+                self.history = self.omodel.history[drifter_index,:].to_masked_array()
             else:
-                self.history = np.concatenate((self.history, self.omodel.history[drifter_index,1:]))
+                self.history = np.concatenate((self.history, self.omodel.history[drifter_index,1:].to_masked_array()))
             drifter_id = self.omodel.elements.ID[drifter_index]
             drifter_lat = self.omodel.elements.lat[drifter_index]
             drifter_lon = self.omodel.elements.lon[drifter_index]
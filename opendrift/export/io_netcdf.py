@@ -2,11 +2,14 @@ import sys
 from datetime import datetime, timedelta
 import string
 from shutil import move
+from copy import copy
 import logging
 
 import numpy as np
 from netCDF4 import Dataset, num2date, date2num
 
+from opendrift.models.history import History
+
 # Module with functions to export/import trajectory data to/from netCDF file
 # Strives to be compliant with netCDF CF-convention on trajectories
 # http://cfconventions.org/Data/cf-conventions/cf-conventions-1.6/build/cf-conventions.html#idp8377728
@@ -21,7 +24,9 @@ def init(self, filename, times=None):
     self.outfile = Dataset(filename, 'w')
     self.outfile.createDimension('trajectory', self.num_elements_total())
     self.outfile.createVariable('trajectory', 'i4', ('trajectory',))
-    self.outfile.createDimension('time', None)  # Unlimited time dimension
+    # If number of output times is known, the time dimension is made
+    # fixed already here, and the file need not be rewritten by close()
+    self.outfile.createDimension('time', times)  # None gives unlimited
     self.outfile.createVariable('time', 'f8', ('time',))
     # NB: trajectory_id must be changed for future ragged array representation
     self.outfile.variables['trajectory'][:] = \
@@ -48,6 +53,15 @@ def init(self, filename, times=None):
             value = str(value)
         self.outfile.setncattr('config_' + key, value)
 
+    # Compression, and chunks of all trajectories and the times
+    # written by each write_buffer, limited to about 4 MB
+    compression_level = self.get_config('export:compression_level')
+    time_chunk = self.export_buffer_length
+    if times is not None:
+        time_chunk = min(time_chunk, times)
+    trajectory_chunk = min(self.num_elements_total(),
+                           max(1, int(4e6/(4*time_chunk))))
+
     # Add all element properties as variables
     for prop in self.history.dtype.fields:
         if prop in skip_parameters:
@@ -58,7 +72,20 @@ def init(self, filename, times=None):
             dtype = self.history.dtype[prop]
         except:
             dtype = 'f4'
-        var = self.outfile.createVariable(prop, dtype, ('trajectory', 'time'))
+        if dtype == np.float16:
+            dtype = 'f4'  # Not supported by netCDF
+        encoding = self.export_encoding.get(prop, {})
+        dtype = encoding.get('dtype', dtype)
+        var = self.outfile.createVariable(
+            prop, dtype, ('trajectory', 'time'),
+            zlib=compression_level > 0, complevel=compression_level,
+            shuffle=self.get_config('export:shuffle'),
+            chunksizes=(trajectory_chunk, time_chunk),
+            least_significant_digit=encoding.get('least_significant_digit'))
+        # Packing, applied by netCDF4 when writing buffer
+        for packing in ['scale_factor', 'add_offset']:
+            if packing in encoding:
+                var.setncattr(packing, encoding[packing])
         var.setncattr('coordinates', 'lat lon time')
         for subprop in self.history_metadata[prop].items():
             if subprop[0] not in ['dtype', 'constant', 'default']:
@@ -67,8 +94,20 @@ def init(self, filename, times=None):
                     continue
                 var.setncattr(subprop[0], subprop[1])
 
+def check_time_dimension(self, num_steps):
+    """Raise ValueError if num_steps do not fit in fixed time dimension."""
+    time_dimension = self.outfile.dimensions['time']
+    if (not time_dimension.isunlimited() and
+            num_steps > len(time_dimension)):
+        raise ValueError('Output of %i time steps does not fit in file %s, '
+                         'created for %i (expected_steps_output) steps' %
+                         (num_steps, self.outfile_name,
+                          len(time_dimension)))
+
+
 def write_buffer(self):
     num_steps_to_export = self.steps_output - self.steps_exported
+    check_time_dimension(self, self.steps_output)
     for prop in self.history_metadata:
         if prop in skip_parameters:
             continue
@@ -78,7 +117,7 @@ def write_buffer(self):
 
     logging.info('Wrote %s steps to file %s' % (num_steps_to_export,
                                                 self.outfile_name))
-    self.history.mask = True  # Reset history array, for new data
+    self.history.reset()  # Reset history array, for new data
     self.steps_exported = self.steps_exported + num_steps_to_export
     self.outfile.sync()  # Flush from memory to disk
 
@@ -86,9 +125,8 @@ def close(self):
 
     # Write status categories metadata
     status_dtype = self.ElementType.variables['status']['dtype']
-    self.outfile.variables['status'].valid_range = np.array([0]).astype(
-        status_dtype), \
-        np.array([len(self.status_categories) - 1]).astype(status_dtype)
+    self.outfile.variables['status'].valid_range = np.array(
+        [0, len(self.status_categories) - 1]).astype(status_dtype)
     self.outfile.variables['status'].flag_values = \
         np.array(np.arange(len(self.status_categories)), dtype=status_dtype)
     self.outfile.variables['status'].flag_meanings = \
@@ -98,6 +136,7 @@ def close(self):
     timeStr = 'seconds since 1970-01-01 00:00:00'
     times = [self.start_time + n*self.time_step_output for n in
              range(self.steps_output)]
+    check_time_dimension(self, len(times))
     self.outfile.variables['time'][0:len(times)] = date2num(times, timeStr)
     self.outfile.variables['time'].units = timeStr
     self.outfile.variables['time'].standard_name = 'time'
@@ -122,34 +161,57 @@ def close(self):
         for key, value in self.metadata_dict.iteritems():
             self.outfile.setncattr(key, str(value))
 
+    # Elements seeded, including those deactivated
+    num_elements = self.num_elements_active() + \
+        self.num_elements_deactivated()
+    time_dimension = self.outfile.dimensions['time']
+    final_size = (not time_dimension.isunlimited() and
+                  len(time_dimension) == self.steps_output and
+                  len(self.outfile.dimensions['trajectory']) == num_elements)
+
     self.outfile.close()  # Finally close file
 
-    # Finally changing UNLIMITED time dimension to fixed, for CDM compliance.
-    # Fortunately this is quite fast.
+    if final_size is True:
+        logging.debug('Dimensions are fixed and complete, no need to rewrite')
+        return
+
+    # Finally changing UNLIMITED time dimension to fixed, for CDM compliance,
+    # and truncating dimensions to the number of elements actually seeded
+    # and steps actually calculated (e.g. if simulation stopped early).
     # http://www.unidata.ucar.edu/software/thredds/current/netcdf-java/reference/FeatureDatasets/CFpointImplement.html
     try:
         logging.debug('Making netCDF file CDM compliant with fixed dimensions')
         with Dataset(self.outfile_name) as src, \
                 Dataset(self.outfile_name + '_tmp', 'w') as dst:
+            sizes = {'trajectory': num_elements,
+                     'time': min(self.steps_output, len(src.dimensions['time']))}
             for name, dimension in src.dimensions.iteritems():
-                if name=='trajectory':
-                    # Truncate dimension length to  number actually seeded
-                    dst.createDimension(name, self.num_elements_activated())
-                else:
-                    dst.createDimension(name, len(dimension))
+                dst.createDimension(name, sizes.get(name, len(dimension)))
 
             for name, variable in src.variables.iteritems():
-                dstVar = dst.createVariable(name, variable.datatype,
-                                             variable.dimensions)
-                srcVar = src.variables[name]
-                # Truncate data to number actually seeded
-                if 'trajectory' in variable.dimensions:
-                    if len(variable.dimensions) == 2:
-                        dstVar[:] = srcVar[0:self.num_elements_activated(), :] 
-                    else:
-                        dstVar[:] = srcVar[0:self.num_elements_activated()]  # Copy data
+                # Keeping compression and chunking, within new sizes
+                chunksizes = variable.chunking()
+                if chunksizes == 'contiguous':
+                    chunksizes = None
                 else:
-                    dstVar[:] = srcVar[:]
+                    chunksizes = [max(1, min(chunk, sizes.get(dim, chunk)))
+                                  for chunk, dim in
+                                  zip(chunksizes, variable.dimensions)]
+                filters = variable.filters() or {}
+                dstVar = dst.createVariable(
+                    name, variable.datatype, variable.dimensions,
+                    zlib=filters.get('zlib', False),
+                    complevel=filters.get('complevel', 4),
+                    shuffle=filters.get('shuffle', True),
+                    chunksizes=chunksizes)
+                srcVar = src.variables[name]
+                # Copy packed/quantized values as they are
+                srcVar.set_auto_maskandscale(False)
+                dstVar.set_auto_maskandscale(False)
+                # Truncate data to number actually seeded and calculated
+                dstVar[:] = srcVar[tuple(
+                    slice(0, sizes[dim]) if dim in sizes else slice(None)
+                    for dim in variable.dimensions)]
                 for att in src.variables[name].ncattrs():
                     # Copy variable attributes
                     dstVar.setncattr(att, srcVar.getncattr(att))
@@ -163,6 +225,91 @@ def close(self):
         print 'Could not convert netCDF file from unlimited to fixed dimension. Could be due to netCDF library incompatibility(?)'
     
 
+class NetCDFHistory(object):
+    """Read-only view of history stored in netCDF file.
+
+    Variables are read from file when requested, so that only the
+    needed data is kept in memory, e.g. for plotting after a run where
+    output was flushed to file. As for the history array of the
+    simulation, history['lon'] returns a masked array of shape
+    (trajectory, time), and history[:, 0:10] returns a new view of a
+    subset, from which only the subset is read, e.g. history[:, -1]['lon'].
+    """
+
+    def __init__(self, filename, index=None):
+        self.filename = filename
+        with Dataset(filename, 'r') as infile:
+            file_shape = (len(infile.dimensions['trajectory']),
+                          len(infile.dimensions['time']))
+            # Packed variables are unpacked to the type of scale_factor
+            self.dtype = np.dtype([
+                (str(name), np.asarray(getattr(var, 'scale_factor',
+                                               np.zeros(0, var.dtype))).dtype)
+                for name, var in infile.variables.iteritems()
+                if name not in ['time', 'trajectory']])
+        if index is None:
+            index = tuple(np.arange(n) for n in file_shape)
+        # Indices of trajectory and time in file, or a scalar index
+        # for a dimension which has been indexed away
+        self.index = index
+        self.shape = tuple(len(i) for i in index if np.ndim(i) == 1)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            if key not in self.dtype.names:
+                raise ValueError('no field of name %s' % key)
+            with Dataset(self.filename, 'r') as infile:
+                return self._read(infile.variables[key])
+        # Indexing along elements and/or time
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > len(self.shape):
+            raise IndexError('too many indices for history')
+        key = key + (slice(None),)*(len(self.shape) - len(key))
+        key = iter(key)
+        view = copy(self)
+        view.index = tuple(i if np.ndim(i) == 0 else i[next(key)]
+                           for i in self.index)
+        view.shape = tuple(len(i) for i in view.index if np.ndim(i) == 1)
+        return view
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, variable):
+        """Read subset of variable, as one block from file."""
+        file_index = []
+        select = []
+        for i in self.index:
+            if np.ndim(i) == 0:
+                file_index.append(int(i))
+            elif len(i) == 0:
+                file_index.append(slice(0, 0))
+                select.append(i)
+            else:
+                first = i.min()
+                file_index.append(slice(first, i.max() + 1))
+                select.append(i - first)
+        data = np.ma.asarray(variable[tuple(file_index)])
+        if any([not np.array_equal(s, np.arange(len(s))) for s in select]):
+            data = data[np.ix_(*select)]
+        return data
+
+    def to_masked_array(self):
+        """Return data of view as masked structured array."""
+        array = np.ma.array(np.zeros(self.shape, dtype=self.dtype),
+                            mask=True)
+        with Dataset(self.filename, 'r') as infile:
+            for name in self.dtype.names:
+                array[name] = self._read(infile.variables[name])
+        return array
+
+
+def open_history(self, filename):
+    """Set history to data in file, which is read only when needed."""
+    self.history = NetCDFHistory(filename)
+
+
 def import_file(self, filename, time=None):
 
     infile = Dataset(filename, 'r')
@@ -196,16 +343,15 @@ def import_file(self, filename, time=None):
     history_dtype = np.dtype(history_dtype_fields)
 
     # Import whole dataset (history)
-    self.history = np.ma.array(
-        np.zeros([num_elements, num_timesteps]),
-        dtype=history_dtype, mask=[True])
+    self.history = History((num_elements, num_timesteps), history_dtype)
     for var in infile.variables:
-        if var in ['time', 'trajectory']:
+        if var in ['time', 'trajectory'] or var not in history_dtype.names:
             continue
-        try:
-            self.history[var] = infile.variables[var][:, :]
-        except:
-            pass
+        self.history.store(slice(None), slice(None), var,
+                           np.ma.filled(infile.variables[var][:, :], 0))
+    # All variables of an element are written for the same times
+    self.history.valid[:] = ~np.ma.getmaskarray(
+        infile.variables['status'][:, :])
 
     # Initialise elements from given (or last) state/time
     firstlast = np.ma.notmasked_edges(self.history['status'], axis=1)
@@ -16,6 +16,7 @@
 
 import sys
 import os
+import copy
 import glob
 import types
 import traceback
@@ -24,7 +25,9 @@ from datetime import datetime, timedelta
 from collections import OrderedDict
 from abc import ABCMeta, abstractmethod, abstractproperty
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import platform
+import threading
 import netCDF4
 
 import numpy as np
@@ -44,8 +47,19 @@ try:
 except:
     logging.info('Basemap is not available, can not make plots')
 
-from opendrift.readers.basereader import pyproj, BaseReader, vector_pairs_xy
-from opendrift.models.physics_methods import PhysicsMethods
+from opendrift.readers.basereader import pyproj, BaseReader, vector_pairs_xy, \
+    nan_filled
+from opendrift.models.physics_methods import PhysicsMethods, \
+    displace_positions, geod
+from opendrift.models.history import History
+from opendrift.readers.rotation import RotationAngleField, rotate
+
+_simulation = None  # Simulation run by run_parallel, inherited by workers
+_timer_lock = threading.Lock()  # Timers are used also by reader threads
+
+
+def _run_partition(args):
+    return _simulation.run_partition(*args)
 
 
 class ModelSettings(object):
@@ -118,15 +132,22 @@ class OpenDriftSimulation(PhysicsMethods):
                 basemap_resolution = option('f', 'h', 'i', 'c', default='h')
                 minimise_map_whitespace = boolean(default=False)
                 coastline_action = option('none', 'stranding', 'previous', default='stranding')
+                reader_threads = integer(min=1, max=64, default=1)
+                history_float_dtype = option('native', 'float32', 'float16', default='native')
+                element_chunk_size = integer(min=0, default=0)
             [drift]
                 scheme = option('euler', 'runge-kutta', default='euler')
+                position_update = option('geodesic', 'tangent-plane', default='geodesic')
                 wind_drift_factor = float(min=0, max=1, default=0.02)
                 stokes_drift = boolean(default=True)
                 current_uncertainty = float(min=0, max=5, default=.1)
                 wind_uncertainty = float(min=0, max=5, default=1)
                 relative_wind = boolean(default=False)
                 use_tabularised_stokes_drift = boolean(default=False)
-                tabularised_stokes_drift_fetch = option(5000, 25000, 50000, default=25000)'''
+                tabularised_stokes_drift_fetch = option(5000, 25000, 50000, default=25000)
+            [export]
+                compression_level = integer(min=0, max=9, default=0)
+                shuffle = boolean(default=True)'''
 
     max_speed = 3  # Assumed max average speed of any element
     required_profiles = None  # Optional possibility to get vertical profiles
@@ -168,6 +189,11 @@ class OpenDriftSimulation(PhysicsMethods):
         # Make copies of dictionaries so that they are private to each instance
         self.status_categories = ['active']  # Particles are active by default
         self.fallback_values = self.fallback_values.copy()
+        # Per variable encoding of output file, e.g.
+        # {'lon': {'least_significant_digit': 4},
+        #  'mass_oil': {'dtype': 'i2', 'scale_factor': .01, 'add_offset': 0}}
+        self.export_encoding = {}
+        self.reset_velocities()
         self.status_colors_default = self.status_colors_default.copy()
 
         if hasattr(self, 'status_colors'):
@@ -199,13 +225,16 @@ class OpenDriftSimulation(PhysicsMethods):
         try:
             io_module = __import__('opendrift.export.io_' + iomodule,
                                    fromlist=['init', 'write_buffer',
-                                             'close', 'import_file'])
+                                             'close', 'import_file',
+                                             'open_history'])
         except ImportError:
             logging.info('Could not import iomodule ' + iomodule)
         self.io_init = types.MethodType(io_module.init, self)
         self.io_write_buffer = types.MethodType(io_module.write_buffer, self)
         self.io_close = types.MethodType(io_module.close, self)
         self.io_import_file = types.MethodType(io_module.import_file, self)
+        self.io_open_history = types.MethodType(
+            getattr(io_module, 'open_history', io_module.import_file), self)
 
         self.timer_start('total time')
         self.timer_start('configuration')
@@ -397,6 +426,7 @@ class OpenDriftSimulation(PhysicsMethods):
     def set_projection(self, proj4):
         """Set the projection onto which data from readers is reprojected."""
         self.proj4 = proj4
+        self.azimuth_field = None  # Calculated when needed
         if proj4 is not None:
             self.proj = pyproj.Proj(self.proj4 + ' +ellps=WGS84')
             logging.info('Calculation SRS set to: ' + self.proj.srs)
@@ -431,18 +461,30 @@ class OpenDriftSimulation(PhysicsMethods):
             return self.proj(x, y, inverse=True)
 
     def timer_start(self, category):
-        if not hasattr(self, 'timers'):
-            self.timers = OrderedDict()
-        if not hasattr(self, 'timing'):
-            self.timing = OrderedDict()
-        if category not in self.timing:
-            self.timing[category] = timedelta(0)
-        self.timers[category] = datetime.now()
+        with _timer_lock:
+            if not hasattr(self, 'timers'):
+                self.timers = OrderedDict()
+            if not hasattr(self, 'timing'):
+                self.timing = OrderedDict()
+            if category not in self.timing:
+                self.timing[category] = timedelta(0)
+            self.timers[category] = datetime.now()
 
     def timer_end(self, category):
-        if self.timers[category] is not None:
-            self.timing[category] += datetime.now() - self.timers[category]
-        self.timers[category] = None
+        with _timer_lock:
+            if self.timers[category] is not None:
+                self.timing[category] += \
+                    datetime.now() - self.timers[category]
+            self.timers[category] = None
+
+    def timer_add(self, category, time_spent):
+        """Add time spent on category, measured by the caller"""
+        with _timer_lock:
+            if not hasattr(self, 'timing'):
+                self.timing = OrderedDict()
+            if category not in self.timing:
+                self.timing[category] = timedelta(0)
+            self.timing[category] += time_spent
 
     def performance(self):
         '''Report the time spent on various tasks'''
@@ -626,6 +668,164 @@ class OpenDriftSimulation(PhysicsMethods):
 
         return variable_groups, reader_groups, missing_variables
 
+    def _independent_reader_groups(self, reader_groups):
+        """Partition reader groups into sets not sharing any reader.
+
+        Returns:
+            tasks: list of lists of indices into reader_groups. Groups in
+                different tasks may be retrieved concurrently, whereas
+                groups within a task are retrieved in the given order.
+        """
+        tasks = []
+        task_readers = []
+        for i, reader_group in enumerate(reader_groups):
+            overlapping = [t for t in range(len(tasks))
+                           if set(reader_group) & task_readers[t]]
+            task = [i]
+            readers = set(reader_group)
+            for t in overlapping[::-1]:
+                task = tasks.pop(t) + task
+                readers = readers | task_readers.pop(t)
+            tasks.append(sorted(task))
+            task_readers.append(readers)
+        return sorted(tasks)
+
+    def _get_environment_group(self, variable_group, reader_group, time,
+                               lon, lat, z, profiles):
+        """Retrieve one group of variables from readers in prioritised order.
+
+        Elements for which a reader does not provide valid data are
+        requested from the next reader in reader_group.
+
+        Returns:
+            env: masked array with the variables of variable_group as
+                fields, initialised with fallback values where available.
+            env_profiles: dictionary of vertical profiles, or None.
+        """
+        dtype = [(var, np.float32) for var in variable_group]
+        env = np.ma.array(np.zeros(len(lon)), dtype=dtype)
+        for variable in variable_group:
+            if (self.fallback_values is not None
+                    and variable in self.fallback_values):
+                env[variable] = np.ma.ones(env[variable].shape)\
+                    * self.fallback_values[variable]
+        env_profiles = None
+
+        logging.debug('----------------------------------------')
+        logging.debug('Variable group %s' % (str(variable_group)))
+        logging.debug('----------------------------------------')
+        missing_indices = np.array(range(len(lon)))
+        # For each reader:
+        for reader_name in reader_group:
+            logging.debug('Calling reader ' + reader_name)
+            logging.debug('----------------------------------------')
+            # Timed locally with timer_add, as timer_start/timer_end
+            # keep state which must not be shared by reader threads
+            reader_timer = 'main loop:readers:' + \
+                reader_name.replace(':', '<colon>')
+            reader_start = datetime.now()
+            reader = self.readers[reader_name]
+            if not reader.covers_time(time):
+                logging.debug('\tOutside time coverage of reader.')
+                self.timer_add(reader_timer, datetime.now() - reader_start)
+                continue
+            # Fetch given variables at given positions from current reader
+            try:
+                logging.debug('Data needed for %i elements' %
+                              len(missing_indices))
+                # Check if vertical profiles are requested from reader
+                if profiles is not None:
+                    profiles_from_reader = list(
+                        set(variable_group) & set(profiles))
+                    if profiles_from_reader == []:
+                        profiles_from_reader = None
+                else:
+                    profiles_from_reader = None
+                env_tmp, env_profiles_tmp = \
+                    reader.get_variables_interpolated(
+                        variable_group, profiles_from_reader,
+                        self.required_profiles_z_range, time,
+                        lon[missing_indices], lat[missing_indices],
+                        z[missing_indices], self.use_block, self.proj)
+                if type(env_tmp) == type(None):
+                    # JRH all elements are outside of boundary area
+                    logging.debug('All elements are outside of boundary '
+                                  'of reader')
+
+            except Exception as e:
+                logging.info('========================')
+                logging.info('Exception:')
+                logging.info(e)
+                logging.debug(traceback.format_exc())
+                logging.info('========================')
+                self.timer_add(reader_timer, datetime.now() - reader_start)
+                continue
+
+            # Copy retrieved variables to env array, and mask nan-values.
+            # Readers return float32 arrays with NaN for missing values,
+            # or masked arrays if fast_time_interpolation is False
+            values_missing = None  # Elements missing any of the variables
+            if isinstance(env_tmp[variable_group[0]], np.ndarray):
+                values_missing = np.zeros(len(env_tmp[variable_group[0]]),
+                                          dtype=np.bool)
+            for var in variable_group:
+                values = env_tmp[var]
+                if isinstance(values, np.ma.MaskedArray):
+                    values = nan_filled(values)
+                values = np.asarray(values, dtype=np.float32)
+                isnan = np.isnan(values)
+                if values_missing is not None and \
+                        len(isnan) == len(values_missing):
+                    values_missing |= isnan
+                env.data[var][missing_indices] = \
+                    values[0:len(missing_indices)]
+                env.mask[var][missing_indices] = isnan[0:len(missing_indices)]
+                if profiles_from_reader is not None and var in profiles_from_reader:
+                    if env_profiles is None:
+                        env_profiles = env_profiles_tmp
+                    # TODO: fix to be checked
+                    if var in env_profiles and var in env_profiles_tmp:
+                        # If one profile has fewer vertical layers than
+                        # the other, we use only the overlapping part
+                        if len(env_profiles['z']) != len(
+                            env_profiles_tmp['z']):
+                            logging.debug('Warning: different number of '
+                                ' vertical layers: %s and %s' % (
+                                    len(env_profiles['z']),
+                                    len( env_profiles_tmp['z'])))
+                        z_ind = np.arange(np.minimum(
+                            len(env_profiles['z'])-1,
+                            len(env_profiles_tmp['z'])-1))
+                        # len(missing_indices) since 2 points might have been added and not removed
+                        values = nan_filled(env_profiles_tmp[var][
+                            z_ind, 0:len(missing_indices)])
+                        env_profiles[var][np.ix_(z_ind, missing_indices)] = \
+                            np.ma.masked_where(np.isnan(values), values,
+                                               copy=False)
+
+            # Detect elements with missing data (masked or NaN),
+            # for present reader group
+            if values_missing is not None:
+                if len(missing_indices) != len(values_missing):
+                    # TODO: mask mismatch due to 2 added points
+                    logging.info('Problems setting mask on missing_indices!')
+                else:
+                    missing_indices = missing_indices[values_missing]
+            else:
+                missing_indices = []  # temporary workaround
+            if (type(missing_indices) == np.int64) or (
+                    type(missing_indices) == np.int32):
+                missing_indices = []
+            self.timer_add(reader_timer, datetime.now() - reader_start)
+            if len(missing_indices) == 0:
+                logging.debug('Obtained data for all elements.')
+                break
+            else:
+                logging.debug('Data missing for %i elements.' %
+                              (len(missing_indices)))
+
+        return env, env_profiles
+
     def get_environment(self, variables, time, lon, lat, z, profiles):
         '''Retrieve environmental variables at requested positions.
 
@@ -635,11 +835,60 @@ class OpenDriftSimulation(PhysicsMethods):
                 [readers].var_block_after (first after requested time)
                     - lists of one ReaderBlock per variable group:
                         - time, x, y, [vars]
+        Independent reader groups (not sharing any reader) are retrieved
+        concurrently if config setting general:reader_threads > 1.
+        If config setting general:element_chunk_size is positive, the
+        positions are processed in chunks of (at most) this size, to
+        limit the size of temporary arrays.
+
         Returns:
             environment: recarray with variables as named attributes,
                          interpolated to requested positions/time.
 
         '''
+        chunk_size = self.get_config('general:element_chunk_size')
+        if chunk_size == 0 or len(lon) <= chunk_size:
+            return self._get_environment(variables, time, lon, lat, z,
+                                         profiles)
+
+        # Elements at the outer edges of the element cloud are added to
+        # each chunk, so that blocks of data fetched by readers cover
+        # all elements, and not only those of the first chunk
+        edges = np.unique([f(a) for a in (lon, lat, lon + lat, lon - lat, z)
+                           for f in (np.argmin, np.argmax)])
+        env_chunks = []
+        env_profiles_chunks = []
+        missing_chunks = []
+        for start in range(0, len(lon), chunk_size):
+            num = min(chunk_size, len(lon) - start)
+            ind = np.concatenate((np.arange(start, start + num), edges))
+            logging.debug('Getting environment for elements %i to %i' %
+                          (start, start + num - 1))
+            env, env_profiles, missing = self._get_environment(
+                variables, time, lon[ind], lat[ind], z[ind], profiles)
+            env_chunks.append(env[0:num])
+            missing_chunks.append(
+                np.broadcast_to(missing, (len(ind),))[0:num])
+            if env_profiles is not None:
+                env_profiles_chunks.append(
+                    {var: env_profiles[var][:, 0:num]
+                     if var != 'z' else env_profiles[var]
+                     for var in env_profiles})
+
+        env = np.concatenate(env_chunks).view(np.recarray)
+        missing = np.concatenate(missing_chunks)
+        if len(env_profiles_chunks) == 0:
+            env_profiles = None
+        else:
+            env_profiles = {var: np.concatenate(
+                [c[var] for c in env_profiles_chunks], axis=1)
+                for var in env_profiles_chunks[0] if var != 'z'}
+            env_profiles['z'] = env_profiles_chunks[0]['z']
+
+        return env, env_profiles, missing
+
+    def _get_environment(self, variables, time, lon, lat, z, profiles):
+        """Retrieve environment at all given positions at once."""
         self.timer_start('main loop:readers')
         # Initialise ndarray to hold environment variables
         dtype = [(var, np.float32) for var in variables]
@@ -654,116 +903,39 @@ class OpenDriftSimulation(PhysicsMethods):
                 env[variable] = np.ma.ones(env[variable].shape)\
                     * self.fallback_values[variable]
 
+        # Variable groups sharing a reader are retrieved by the same
+        # worker, as reader buffers and datasets are not thread safe
+        num_threads = self.get_config('general:reader_threads')
+        tasks = self._independent_reader_groups(reader_groups)
+        if num_threads > 1 and len(tasks) > 1:
+            logging.debug('Fetching %s independent reader groups with %s '
+                          'threads' % (len(tasks), num_threads))
+            pool = ThreadPool(min(num_threads, len(tasks)))
+            try:
+                task_results = pool.map(
+                    lambda task: [self._get_environment_group(
+                        variable_groups[i], reader_groups[i], time,
+                        lon, lat, z, profiles) for i in task], tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            task_results = [[self._get_environment_group(
+                variable_groups[i], reader_groups[i], time,
+                lon, lat, z, profiles) for i in task] for task in tasks]
+        group_results = {}
+        for task, results in zip(tasks, task_results):
+            group_results.update(zip(task, results))
+
+        # Merge results in order of variable groups
         for i, variable_group in enumerate(variable_groups):
-            logging.debug('----------------------------------------')
-            logging.debug('Variable group %s' % (str(variable_group)))
-            logging.debug('----------------------------------------')
-            reader_group = reader_groups[i]
-            missing_indices = np.array(range(len(lon)))
-            # For each reader:
-            for reader_name in reader_group:
-                logging.debug('Calling reader ' + reader_name)
-                logging.debug('----------------------------------------')
-                self.timer_start('main loop:readers:' +
-                                 reader_name.replace(':', '<colon>'))
-                reader = self.readers[reader_name]
-                if not reader.covers_time(time):
-                    logging.debug('\tOutside time coverage of reader.')
-                    continue
-                # Fetch given variables at given positions from current reader
-                try:
-                    logging.debug('Data needed for %i elements' %
-                                  len(missing_indices))
-                    # Check if vertical profiles are requested from reader
-                    if profiles is not None:
-                        profiles_from_reader = list(
-                            set(variable_group) & set(profiles))
-                        if profiles_from_reader == []:
-                            profiles_from_reader = None
-                    else:
-                        profiles_from_reader = None
-                    env_tmp, env_profiles_tmp = \
-                        reader.get_variables_interpolated(
-                            variable_group, profiles_from_reader,
-                            self.required_profiles_z_range, time,
-                            lon[missing_indices], lat[missing_indices],
-                            z[missing_indices], self.use_block, self.proj)
-                    if type(env_tmp) == type(None):
-                        # JRH all elements are outside of boundary area
-                        print("ALL VARIABLES ARE OUTSIDE OF BOUNDARY, quiting loop")
-
-                except Exception as e:
-                    logging.info('========================')
-                    logging.info('Exception:')
-                    logging.info(e)
-                    logging.debug(traceback.format_exc())
-                    logging.info('========================')
-                    self.timer_end('main loop:readers:' +
-                                   reader_name.replace(':', '<colon>'))
-                    continue
-
-                # Copy retrieved variables to env array, and mask nan-values
-                for var in variable_group:
-                    env[var][missing_indices] = np.ma.masked_invalid(
-                        env_tmp[var][0:len(missing_indices)]).astype('float32')
-                    if profiles_from_reader is not None and var in profiles_from_reader:
-                        if 'env_profiles' not in locals():
-                            env_profiles = env_profiles_tmp
-                        # TODO: fix to be checked
-                        if var in env_profiles and var in env_profiles_tmp:
-                            # If one profile has fewer vertical layers than
-                            # the other, we use only the overlapping part
-                            if len(env_profiles['z']) != len(
-                                env_profiles_tmp['z']):
-                                logging.debug('Warning: different number of '
-                                    ' vertical layers: %s and %s' % (
-                                        len(env_profiles['z']),
-                                        len( env_profiles_tmp['z'])))
-                            z_ind = np.arange(np.minimum(
-                                len(env_profiles['z'])-1,
-                                len(env_profiles_tmp['z'])-1))
-                            # len(missing_indices) since 2 points might have been added and not removed
-                            env_profiles[var][np.ix_(z_ind, missing_indices)] = \
-                                np.ma.masked_invalid(env_profiles_tmp[var][z_ind,0:len(missing_indices)]).astype('float32')
-
-                # Detect elements with missing data, for present reader group
-                if hasattr(env_tmp[variable_group[0]], 'mask'):
-                    try:
-                        del combined_mask
-                    except:
-                        pass
-                    for var in variable_group:
-                        tmp_var = np.ma.masked_invalid(env_tmp[var])
-                        # Changed 13 Oct 2016, but uncertain of effect
-                        # TODO: to be checked
-                        #tmp_var = env_tmp[var]
-                        if 'combined_mask' not in locals():
-                            combined_mask = np.ma.getmask(tmp_var)
-                        else:
-                            combined_mask = \
-                                np.ma.mask_or(combined_mask,
-                                              np.ma.getmask(tmp_var),
-                                              shrink=False)
-                    try:
-                        if len(missing_indices) != len(combined_mask):
-                            # TODO: mask mismatch due to 2 added points
-                            raise ValueError('Mismatch of masks')
-                        missing_indices = missing_indices[combined_mask]
-                    except:  # Not sure what is happening here
-                        logging.info('Problems setting mask on missing_indices!')
-                else:
-                    missing_indices = []  # temporary workaround
-                if (type(missing_indices) == np.int64) or (
-                        type(missing_indices) == np.int32):
-                    missing_indices = []
-                self.timer_end('main loop:readers:' +
-                               reader_name.replace(':', '<colon>'))
-                if len(missing_indices) == 0:
-                    logging.debug('Obtained data for all elements.')
-                    break
-                else:
-                    logging.debug('Data missing for %i elements.' %
-                                  (len(missing_indices)))
+            env_group, env_profiles_group = group_results[i]
+            for var in variable_group:
+                env[var] = env_group[var]
+            # Profiles are taken from the first group providing any
+            if env_profiles_group is not None and \
+                    'env_profiles' not in locals():
+                env_profiles = env_profiles_group
 
         logging.debug('---------------------------------------')
         logging.debug('Finished processing all variable groups')
@@ -772,9 +944,9 @@ class OpenDriftSimulation(PhysicsMethods):
             if (var not in variables) and (profiles is None or var not in profiles):
                 continue
             mask = env[var].mask
-            if sum(mask==True) > 0:
+            if np.sum(mask) > 0:
                 logging.debug('    Using fallback value %s for %s for %s elements' %
-                              (self.fallback_values[var], var, sum(mask==True)))
+                              (self.fallback_values[var], var, np.sum(mask)))
                 env[var][mask] = self.fallback_values[var]
             # Profiles
             if profiles is not None and var in profiles:
@@ -788,15 +960,15 @@ class OpenDriftSimulation(PhysicsMethods):
                     logging.debug('      Using fallback value %s for %s for all profiles' %
                                   (self.fallback_values[var], var))
                     env_profiles[var] = self.fallback_values[var]*\
-                        np.ma.ones((len(env_profiles['z']), self.num_elements_active()))
+                        np.ma.ones((len(env_profiles['z']), len(lon)))
                 else:
                     mask = env_profiles[var].mask
-                    num_masked_values_per_element = sum(mask==True)
-                    num_missing_profiles = sum(num_masked_values_per_element == len(env_profiles['z']))
+                    num_masked_values_per_element = np.sum(mask, axis=0)
+                    num_missing_profiles = np.sum(num_masked_values_per_element == len(env_profiles['z']))
                     env_profiles[var][mask] = self.fallback_values[var]
                     logging.debug('      Using fallback value %s for %s for %s profiles' %
                                   (self.fallback_values[var], var, num_missing_profiles,))
-                    num_missing_individual = sum(num_masked_values_per_element > 0) - num_missing_profiles
+                    num_missing_individual = np.sum(num_masked_values_per_element > 0) - num_missing_profiles
                     if num_missing_individual > 0:
                         logging.debug('        ...plus %s individual points in other profiles' %
                                       num_missing_individual)
@@ -817,21 +989,22 @@ class OpenDriftSimulation(PhysicsMethods):
         # Parameterisation of unavailable variables
         #######################################################
         if self.get_config('drift:use_tabularised_stokes_drift') is True:
+            fetch = self.get_config('drift:tabularised_stokes_drift_fetch')
+            x_wind = np.ma.filled(env['x_wind'], np.nan)
+            y_wind = np.ma.filled(env['y_wind'], np.nan)
             if (env['sea_surface_wave_stokes_drift_x_velocity'].max() == 0 and
                 env['sea_surface_wave_stokes_drift_y_velocity'].max() == 0):
                     logging.info('Calculating parameterised stokes drift')
-                    for i in range(len(env['x_wind'])):
-                        env['sea_surface_wave_stokes_drift_x_velocity'][i], \
-                        env['sea_surface_wave_stokes_drift_y_velocity'][i] = \
-                            self.wave_stokes_drift_parameterised((env['x_wind'][i], env['y_wind'][i]),
-                            self.get_config('drift:tabularised_stokes_drift_fetch'))
+                    env['sea_surface_wave_stokes_drift_x_velocity'], \
+                    env['sea_surface_wave_stokes_drift_y_velocity'] = \
+                        self.wave_stokes_drift_parameterised_array(
+                            x_wind, y_wind, fetch)
 
             if (env['sea_surface_wave_significant_height'].max() == 0):
                     logging.info('Calculating parameterised significant wave height')
-                    for i in range(len(env['x_wind'])):
-                        env['sea_surface_wave_significant_height'][i] = \
-                            self.wave_significant_height_parameterised((env['x_wind'][i], env['y_wind'][i]),
-                            self.get_config('drift:tabularised_stokes_drift_fetch'))
+                    env['sea_surface_wave_significant_height'] = \
+                        self.wave_significant_height_parameterised_array(
+                            x_wind, y_wind, fetch)
 
         #####################
         # Diagnostic output
@@ -1297,7 +1470,7 @@ class OpenDriftSimulation(PhysicsMethods):
 
     def deactivate_elements(self, indices, reason='deactivated'):
         """Schedule deactivated particles for deletion (at end of step)"""
-        if sum(indices) == 0:
+        if np.sum(indices) == 0:
             return
         if reason not in self.status_categories:
             self.status_categories.append(reason)
@@ -1310,7 +1483,7 @@ class OpenDriftSimulation(PhysicsMethods):
             self.elements.status.fill(status)
         self.elements.status[indices] = reason_number
         logging.debug('%s elements scheduled for deactivation (%s)' %
-                      (sum(indices), reason))
+                      (np.sum(indices), reason))
 
     def remove_deactivated_elements(self):
         """Moving deactivated elements from self.elements
@@ -1321,16 +1494,16 @@ class OpenDriftSimulation(PhysicsMethods):
         #try:
         #    len(indices)
         #except:
-        if indices == [] or len(indices) == 0 or sum(indices) == 0:
+        if indices == [] or len(indices) == 0 or np.sum(indices) == 0:
             logging.debug('No elements to deactivate')
             return  # No elements scheduled for deactivation
         # Basic, but some more housekeeping will be required later
         self.elements.move_elements(self.elements_deactivated, indices)
-        logging.debug('Removed %i elements.' % (sum(indices)))
+        logging.debug('Removed %i elements.' % (np.sum(indices)))
         if hasattr(self, 'environment'):
             self.environment = self.environment[~indices]
             logging.debug('Removed %i values from environment.' %
-                          (sum(indices)))
+                          (np.sum(indices)))
         if hasattr(self, 'environment_profiles') and \
                 self.environment_profiles is not None:
             for varname, profiles in self.environment_profiles.iteritems():
@@ -1339,10 +1512,75 @@ class OpenDriftSimulation(PhysicsMethods):
                     self.environment_profiles[varname] = \
                         profiles[:, ~indices]
             logging.debug('Removed %i values from environment_profiles.' %
-                          (sum(indices)))
+                          (np.sum(indices)))
             #if self.num_elements_active() == 0:
             #    raise ValueError('No more active elements.')  # End simulation
 
+    def element_chunks(self):
+        """Iterate over chunks of active elements, e.g. to update in chunks.
+
+        Chunks are of size general:element_chunk_size (if positive, else
+        all elements form one chunk). Within each iteration, self.elements,
+        self.environment and self.environment_profiles contain only the
+        elements of the chunk, and element properties are copied back
+        to all elements after each iteration. Yields index slice of chunk.
+        """
+        num = self.num_elements_active()
+        chunk_size = self.get_config('general:element_chunk_size')
+        if chunk_size == 0 or num <= chunk_size:
+            yield slice(0, num)
+            return
+
+        if not self.proj.is_latlong():
+            # Azimuth field shall cover all elements, not only first chunk
+            x, y = self.lonlat2xy(self.elements.lon, self.elements.lat)
+            self.azimuth_srs([np.nanmin(x), np.nanmax(x)],
+                             [np.nanmin(y), np.nanmax(y)])
+
+        elements = self.elements
+        environment = self.environment
+        environment_profiles = self.environment_profiles
+        try:
+            for start in range(0, num, chunk_size):
+                chunk = slice(start, min(start + chunk_size, num))
+                logging.debug('Updating elements %i to %i' %
+                              (chunk.start, chunk.stop - 1))
+                self.elements = copy.copy(elements)
+                for var in elements.variables:
+                    values = getattr(elements, var)
+                    if isinstance(values, np.ndarray) and values.ndim > 0:
+                        setattr(self.elements, var, values[chunk])
+                self.environment = environment[chunk]
+                if environment_profiles is not None:
+                    self.environment_profiles = {
+                        var: environment_profiles[var][:, chunk]
+                        if var != 'z' else environment_profiles[var]
+                        for var in environment_profiles}
+
+                yield chunk
+
+                # Copy back properties which are not updated in place
+                for var in elements.variables:
+                    values = getattr(elements, var)
+                    new_values = getattr(self.elements, var)
+                    if not isinstance(values, np.ndarray) or \
+                            values.ndim == 0:
+                        if not isinstance(new_values, np.ndarray) and \
+                                new_values == values:
+                            continue  # Scalar is unchanged
+                        values = values*np.ones(
+                            num, dtype=elements.variables[var]['dtype'])
+                        setattr(elements, var, values)
+                    dtype = np.result_type(values, new_values)
+                    if dtype != values.dtype:  # E.g. float64 positions
+                        values = values.astype(dtype)
+                        setattr(elements, var, values)
+                    values[chunk] = new_values
+        finally:
+            self.elements = elements
+            self.environment = environment
+            self.environment_profiles = environment_profiles
+
     def run(self, time_step=3600, steps=None, time_step_output=None,
             duration=None, end_time=None, outfile=None, export_variables=None,
             export_buffer_length=100, stop_on_error=False):
@@ -1581,11 +1819,19 @@ class OpenDriftSimulation(PhysicsMethods):
                 if m not in self.export_variables:
                     del self.history_metadata[m]
 
+        # Optionally reducing precision of floats, except for positions
+        float_dtype = self.get_config('general:history_float_dtype')
+        if float_dtype != 'native':
+            float_dtype = np.dtype(float_dtype)
+            history_dtype_fields = [
+                (name, float_dtype) if np.dtype(dtype).kind == 'f' and
+                np.dtype(dtype).itemsize > float_dtype.itemsize and
+                name not in ['lon', 'lat'] else (name, dtype)
+                for name, dtype in history_dtype_fields]
+
         history_dtype = np.dtype(history_dtype_fields)
-        self.history = np.ma.array(np.zeros((len(self.elements_scheduled),
-                                             self.export_buffer_length)),
-                                   dtype=history_dtype)
-        self.history.mask = True
+        self.history = History((len(self.elements_scheduled),
+                                self.export_buffer_length), history_dtype)
         self.steps_exported = 0
 
         if outfile is not None:
@@ -1672,7 +1918,10 @@ class OpenDriftSimulation(PhysicsMethods):
                     logging.debug('Calling %s.update()' %
                                   type(self).__name__)
                     self.timer_start('main loop:updating elements')
-                    self.update()
+                    for chunk in self.element_chunks():
+                        self.reset_velocities()
+                        self.update()
+                        self.flush_velocities()
                     self.timer_end('main loop:updating elements')
                     #####################################################
 
@@ -1687,6 +1936,11 @@ class OpenDriftSimulation(PhysicsMethods):
                     # Updating time
                     if self.time is not None:
                         self.time = self.time + self.time_step
+                else:
+                    # No elements released yet, e.g. if scheduled elements
+                    # were divided among processes by run_parallel
+                    self.steps_calculation += 1
+                    self.time = self.time + self.time_step
 
             except Exception as e:
                 logging.info('========================')
@@ -1702,16 +1956,21 @@ class OpenDriftSimulation(PhysicsMethods):
         self.timer_start('cleaning up')
         logging.debug('Cleaning up')
 
-        self.interact_with_coastline()
-        self.state_to_buffer()  # Append final status to buffer
+        # No final status if no elements were released during run,
+        # e.g. for a partition of run_parallel
+        if self.num_elements_active() + self.num_elements_deactivated() > 0:
+            self.interact_with_coastline()
+            self.state_to_buffer()  # Append final status to buffer
 
         if outfile is not None:
             logging.debug('Writing and closing output file: %s' % outfile)
             # Write buffer to outfile, and close
+            self.timer_start('writing output')
             if self.steps_output >= self.steps_exported:
                 # Write last lines, if needed
                 self.io_write_buffer()
             self.io_close()
+            self.timer_end('writing output')
 
         # Remove any elements scheduled for deactivation during last step
         #self.remove_deactivated_elements()
@@ -1723,12 +1982,12 @@ class OpenDriftSimulation(PhysicsMethods):
             #    range(self.num_elements_activated()), :]
             # Remove rows for unreached timsteps in history array
             self.history = self.history[:, range(self.steps_output)]
-        else:  # If output has been flushed to file during run, we
-               # need to reimport from file to get all data in memory
+        else:  # If output has been flushed to file during run, history
+               # is read from file when needed, not kept in memory
             del self.environment
             if hasattr(self, 'environment_profiles'):
                 del self.environment_profiles
-            self.io_import_file(outfile)
+            self.io_open_history(outfile)
 
         if self.dynamical_landmask is True:
             self.zoom_map(buffer=.2)  # Zooming to extent of trajectories
@@ -1736,6 +1995,136 @@ class OpenDriftSimulation(PhysicsMethods):
         self.timer_end('cleaning up')
         self.timer_end('total time')
 
+    def run_parallel(self, processes=None, outfile=None, **kwargs):
+        """Run simulation with elements divided among several processes.
+
+        The scheduled elements are divided evenly (by ID) among the
+        processes, and each part is run in a separate process (forked),
+        with its own file handles of the readers. As elements move
+        independently of each other, the result is the same as for run(),
+        except for the random perturbations (e.g. diffusion), which are
+        drawn separately for each process.
+
+        The history of all elements is gathered, and eventually written
+        to outfile, when all processes are finished.
+
+        Arguments:
+            processes: number of processes (default: number of CPUs).
+            outfile: netCDF file to which output is written.
+            **kwargs: other arguments, as for run().
+        """
+        global _simulation
+        if self.num_elements_scheduled() == 0:
+            raise ValueError('Please seed elements before starting a run.')
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        num_elements = self.num_elements_scheduled()
+        processes = max(1, min(processes, num_elements))
+        for argument in ['export_buffer_length', 'stop_on_error']:
+            if argument in kwargs:
+                logging.info('Neglecting %s for parallel run' % argument)
+                del kwargs[argument]
+        self.timer_end('configuration')
+        self.timer_start('main loop')
+        seeds = np.random.randint(0, 2**31 - 1, processes)
+        partitions = [(i, processes, seeds[i], kwargs)
+                      for i in range(processes)]
+        logging.info('Running %i elements in %i processes' %
+                     (num_elements, processes))
+        _simulation = self
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_partition, partitions)
+        finally:
+            pool.close()
+            pool.join()
+            _simulation = None
+        self.timer_end('main loop')
+
+        # Gathering results of all partitions
+        self.timer_start('cleaning up')
+        last = max(results, key=lambda r: r['steps_output'])
+        for attribute in ['time_step', 'time_step_output', 'steps_output',
+                          'steps_calculation', 'expected_steps_output',
+                          'history_metadata', 'export_variables',
+                          'proj4', 'time']:
+            setattr(self, attribute, last[attribute])
+        self.set_projection(self.proj4)
+        # Status categories may have been added in different order
+        for result in results:
+            for category in result['status_categories']:
+                if category not in self.status_categories:
+                    self.status_categories.append(category)
+        for result in results:
+            status_map = np.array([self.status_categories.index(category)
+                                   for category in
+                                   result['status_categories']])
+            for name in ['elements', 'elements_deactivated',
+                         'elements_scheduled']:
+                if len(result[name]) > 0:
+                    result[name].status = status_map[np.asarray(
+                        result[name].status, dtype=int)]
+            if 'status' in result['history'].data:
+                status = result['history'].data['status']
+                status[:] = status_map[status]
+        self.history = History.combine(
+            [r['history'] for r in results],
+            [np.arange(i, num_elements, processes) for i in range(processes)])
+        self.steps_exported = 0
+        self.export_buffer_length = self.steps_output
+        if outfile is not None:
+            self.timer_start('writing output')
+            self.io_init(outfile, times=self.steps_output)
+            self.io_write_buffer()
+        for name in ['elements', 'elements_deactivated',
+                     'elements_scheduled']:
+            elements = self.ElementType()
+            for result in results:
+                if len(result[name]) > 0:
+                    elements.extend(result[name])
+            setattr(self, name, elements)
+        self.elements_scheduled_time = np.concatenate(
+            [r['elements_scheduled_time'] for r in results])
+        if outfile is not None:
+            self.io_close()
+            self.timer_end('writing output')
+            self.io_open_history(outfile)
+        self.timer_end('cleaning up')
+        self.timer_end('total time')
+
+    def run_partition(self, partition, num_partitions, seed, kwargs):
+        """Run simulation of every num_partitions element, from partition.
+
+        To be called in a process forked by run_parallel. Returns history,
+        elements and other results, with original element IDs.
+        """
+        for reader in self.readers.values():
+            reader.reopen()
+        np.random.seed(seed)
+        # Renumbering elements of partition from 1, as
+        # history is indexed by element ID
+        indices = (self.elements_scheduled.ID - 1) % num_partitions == \
+            partition
+        elements = self.ElementType()
+        self.elements_scheduled.move_elements(elements, indices)
+        elements.ID = (elements.ID - 1)//num_partitions + 1
+        self.elements_scheduled = elements
+        self.elements_scheduled_time = self.elements_scheduled_time[indices]
+        self.run(**kwargs)
+        for name in ['elements', 'elements_deactivated',
+                     'elements_scheduled']:
+            elements = getattr(self, name)
+            if len(elements) > 0:
+                elements.ID = (elements.ID - 1)*num_partitions + \
+                    partition + 1
+        result = {name: getattr(self, name) for name in [
+            'history', 'elements', 'elements_deactivated',
+            'elements_scheduled', 'elements_scheduled_time',
+            'status_categories', 'time_step', 'time_step_output',
+            'steps_output', 'steps_calculation', 'expected_steps_output',
+            'history_metadata', 'export_variables', 'proj4', 'time']}
+        return result
+
     def state_to_buffer(self):
         """Append present state (elements and environment) to recarray."""
 
@@ -1770,21 +2159,24 @@ class OpenDriftSimulation(PhysicsMethods):
             # from 0 to num_elements_active()
             # Does not hold when importing ID from a saved file, where
             # some elements have been deactivated
-            self.history[var][ID_ind, time_ind] = \
-                getattr(self.elements, var)[element_ind]
+            self.history.store(ID_ind, time_ind, var,
+                               getattr(self.elements, var)[element_ind])
         # Copy environment data to history array
         for i, var in enumerate(self.environment.dtype.names):
             if self.export_variables is not None and \
                     var not in self.export_variables:
                 continue
-            self.history[var][ID_ind, time_ind] = \
-                getattr(self.environment, var)[element_ind]
+            self.history.store(ID_ind, time_ind, var,
+                               getattr(self.environment, var)[element_ind])
+        self.history.validate(ID_ind, time_ind)
 
         # Call writer if buffer is full
         if (self.outfile is not None) and \
                 ((self.steps_output - self.steps_exported) ==
                     self.export_buffer_length):
+            self.timer_start('writing output')
             self.io_write_buffer()
+            self.timer_end('writing output')
         #from IPython import embed; embed()
 
     def index_of_activation_and_deactivation(self):
@@ -2673,6 +3065,77 @@ class OpenDriftSimulation(PhysicsMethods):
 
         return prop.T, status.T
 
+    def reset_velocities(self):
+        """Discard velocities accumulated with add_velocity."""
+        self.velocity_sum = None
+        # Contribution of each source (x_vel, y_vel), kept until next step
+        self.velocity_contributions = OrderedDict()
+
+    def add_velocity(self, x_vel, y_vel, source='other'):
+        """Add velocity to be applied to elements at end of time step.
+
+        Contributions (e.g. ocean current, wind drift, Stokes drift) are
+        summed, and elements are moved only once, with flush_velocities,
+        after update() of the model. Thus the projection metrics (rotation
+        of SRS) need only be calculated once per time step.
+
+        Arguments:
+            x_vel and y_vel: floats or arrays, velocities in m/s
+                along x- and y-axes of the inherit SRS (proj4).
+            source: string, name of contribution, for diagnostics.
+        """
+        if source in self.velocity_contributions:
+            prev_x, prev_y = self.velocity_contributions[source]
+            self.velocity_contributions[source] = (prev_x + x_vel,
+                                                   prev_y + y_vel)
+        else:
+            self.velocity_contributions[source] = (x_vel, y_vel)
+        if self.velocity_sum is None:
+            self.velocity_sum = (x_vel, y_vel)
+        else:
+            self.velocity_sum = (self.velocity_sum[0] + x_vel,
+                                 self.velocity_sum[1] + y_vel)
+
+    def flush_velocities(self):
+        """Move elements with the sum of velocities added this time step."""
+        if self.velocity_sum is None:
+            return
+        x_vel, y_vel = self.velocity_sum
+        self.velocity_sum = None
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for source, (x, y) in self.velocity_contributions.items():
+                speed = np.sqrt(np.power(x, 2) + np.power(y, 2))
+                logging.debug('Velocity from %s: mean %s m/s, max %s m/s' %
+                              (source, np.mean(speed), np.max(speed)))
+        num = self.num_elements_active()
+        self.update_positions(x_vel*np.ones(num), y_vel*np.ones(num))
+
+    def calculate_azimuth_srs(self, x, y):
+        """Azimuth (radians) of y-axis of calculation SRS at x, y."""
+        delta_y = 1000  # Using delta of 1000 m to calculate azimuth
+        lon, lat = self.xy2lonlat(x, y)
+        lon2, lat2 = self.xy2lonlat(x, y + delta_y)
+        return np.radians(geod.inv(lon, lat, lon2, lat2)[0])
+
+    def azimuth_srs(self, x, y):
+        """Cosine and sine of azimuth of y-axis of SRS at x, y (arrays).
+
+        Values are interpolated from a field of azimuths, which is
+        calculated when needed to cover the given positions, with a
+        margin so that it may be reused for many time steps.
+        """
+        field = getattr(self, 'azimuth_field', None)
+        if field is None or not field.covers(x, y):
+            xmin, xmax = np.nanmin(x), np.nanmax(x)
+            ymin, ymax = np.nanmin(y), np.nanmax(y)
+            margin = max(xmax - xmin, ymax - ymin, 20000)/2.
+            field = RotationAngleField(self.calculate_azimuth_srs,
+                                       xmin - margin, xmax + margin,
+                                       ymin - margin, ymax + margin,
+                                       nx=200, ny=200)
+            self.azimuth_field = field
+        return field(x, y)
+
     def update_positions(self, x_vel, y_vel):
         """Move particles according to given velocity components.
 
@@ -2680,32 +3143,29 @@ class OpenDriftSimulation(PhysicsMethods):
         on a map projection does not necessarily correspond to the same
         distance over true ground (not yet implemented).
 
+        The displacement is calculated along geodesics, or faster in
+        the local tangent plane (config setting drift:position_update).
+
         Arguments:
             x_vel and v_vel: floats, velocities in m/s of particle along
                              x- and y-axes of the inherit SRS (proj4).
         """
 
-        geod = pyproj.Geod(ellps='WGS84')
-
-        azimuth = np.degrees(np.arctan2(x_vel, y_vel))  # Direction of motion
-        velocity = np.sqrt(x_vel**2 + y_vel**2)  # Velocity in m/s
-
         if not self.proj.is_latlong():  # Need to rotate SRS
             # Calculate x,y from lon,lat
             self.elements.x, self.elements.y = self.lonlat2xy(
                 self.elements.lon, self.elements.lat)
-            # Calculate azimuth orientation of y-axis at particle locations
-            delta_y = 1000  # Using delta of 1000 m to calculate azimuth
-            lon2, lat2 = self.xy2lonlat(self.elements.x,
-                                        self.elements.y + delta_y)
-            azimuth_srs = geod.inv(self.elements.lon, self.elements.lat,
-                                   lon2, lat2)[0]
-            azimuth = azimuth + azimuth_srs
+            # Azimuth orientation of y-axis at particle locations
+            cos_azimuth, sin_azimuth = self.azimuth_srs(self.elements.x,
+                                                        self.elements.y)
+            # Eastward and northward components
+            x_vel, y_vel = rotate(x_vel, y_vel, cos_azimuth, sin_azimuth)
 
         # Calculate new positions
-        self.elements.lon, self.elements.lat, back_az = geod.fwd(
-            self.elements.lon, self.elements.lat,
-            azimuth, velocity*self.time_step.total_seconds())
+        self.elements.lon, self.elements.lat = displace_positions(
+            self.elements.lon, self.elements.lat, x_vel, y_vel,
+            self.time_step.total_seconds(),
+            self.get_config('drift:position_update'))
 
         # Check that new positions are valid
         if (self.elements.lon.min() < -180) or (
@@ -0,0 +1,254 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+"""Ensembles of simulations with perturbed settings, run in parallel.
+
+Each member is a separate simulation (instance of the given model class),
+with settings given in sections, which are dictionaries:
+
+    'model': keyword arguments to the model constructor
+    'config': configuration settings, for set_config
+    'fallback_values': fallback values of environment variables
+    'seed_elements': keyword arguments to seed_elements
+    'run': keyword arguments to run
+
+The settings of each member are merged with the settings common to all
+members. Members are run in a pool of processes, forked from the parent
+process, so that readers (with metadata, lookup grids and cached blocks
+of data) are made only once, and shared read-only by all members. Only
+summaries of each member (final positions, status counts and density of
+elements) are returned to the parent, not the full history.
+"""
+
+import logging
+import itertools
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+
+sections = ['model', 'config', 'fallback_values', 'seed_elements', 'run']
+
+_ensemble = None  # Ensemble being run, inherited by forked processes
+
+
+def parameter_sweep(**settings):
+    """Return list of member settings with all combinations of values.
+
+    E.g. parameter_sweep(seed_elements={'wind_drift_factor': [.02, .03]},
+                         config={'drift:current_uncertainty': [0, .1]})
+    returns 4 members.
+    """
+    keys = []
+    values = []
+    for section in settings:
+        if section not in sections:
+            raise ValueError('Unknown section %s, should be one of %s' %
+                             (section, sections))
+        for key, value in settings[section].iteritems():
+            keys.append((section, key))
+            values.append(value)
+    members = []
+    for combination in itertools.product(*values):
+        member = {}
+        for (section, key), value in zip(keys, combination):
+            member.setdefault(section, {})[key] = value
+        members.append(member)
+    return members
+
+
+def _init_process():
+    """Reopen files of readers in new process, not to share file handles."""
+    for reader in _ensemble.readers:
+        reader.reopen()
+
+
+def _run_member(index):
+    return index, _ensemble.run_member(index)
+
+
+class Ensemble(object):
+    """Ensemble of simulations with given model class and readers.
+
+    Arguments:
+        model_class: subclass of OpenDriftSimulation, e.g. OpenOil
+        members: list of dictionaries with settings of each member
+            (see module documentation), e.g. from parameter_sweep()
+        readers: list of readers, added to all members
+        lon_bins, lat_bins: edges of grid cells for density of
+            elements. If not given, density is not calculated.
+        **common: settings common to all members, given as sections,
+            e.g. seed_elements={'lon': 4, 'lat': 60, 'number': 1000}
+    """
+
+    def __init__(self, model_class, members, readers=None,
+                 lon_bins=None, lat_bins=None, **common):
+        self.model_class = model_class
+        self.members = members
+        if readers is None:
+            readers = []
+        self.readers = readers
+        self.lon_bins = lon_bins
+        self.lat_bins = lat_bins
+        for section in common:
+            if section not in sections:
+                raise ValueError('Unknown section %s, should be one of %s'
+                                 % (section, sections))
+        self.common = common
+        self.results = None
+
+    def member_settings(self, index):
+        """Return settings of given member, merged with common settings."""
+        settings = {}
+        for section in sections:
+            settings[section] = dict(self.common.get(section, {}))
+            settings[section].update(self.members[index].get(section, {}))
+        # Separate random perturbations for each member, unless given
+        settings['model'].setdefault('seed', index)
+        settings['model'].setdefault('loglevel', 30)
+        outfile = settings['run'].get('outfile')
+        if outfile is not None and '%' in outfile:
+            settings['run']['outfile'] = outfile % index
+        return settings
+
+    def run_member(self, index):
+        """Run given member, and return summary of result."""
+        settings = self.member_settings(index)
+        o = self.model_class(**settings['model'])
+        if len(self.readers) > 0:
+            o.add_reader(self.readers)
+        o.fallback_values.update(settings['fallback_values'])
+        for key, value in settings['config'].iteritems():
+            o.set_config(key, value)
+        o.seed_elements(**settings['seed_elements'])
+        o.run(**settings['run'])
+        return self.summary(o)
+
+    def summary(self, o):
+        """Return final positions, status counts and density of run."""
+        times = o.get_time_array()[0]
+        lon, status = o.get_property('lon')
+        lat = o.get_property('lat')[0]
+        lon = lon[0:len(times)]
+        lat = lat[0:len(times)]
+        status = status[0:len(times)]
+        summary = {'times': times,
+                   'lon': lon[-1].filled(np.nan),
+                   'lat': lat[-1].filled(np.nan),
+                   'status': status[-1].filled(-1),
+                   'status_counts': {}}
+        for i, category in enumerate(o.status_categories):
+            summary['status_counts'][category] = \
+                np.ma.sum(status == i, axis=1).filled(0)
+        if self.lon_bins is not None and self.lat_bins is not None:
+            density = np.zeros((len(times), len(self.lon_bins) - 1,
+                                len(self.lat_bins) - 1), dtype=np.int32)
+            for i in range(len(times)):
+                valid = ~np.ma.getmaskarray(lon[i]) & \
+                    ~np.ma.getmaskarray(lat[i])
+                density[i] = np.histogram2d(
+                    lon[i].data[valid], lat[i].data[valid],
+                    bins=(self.lon_bins, self.lat_bins))[0]
+            summary['density'] = density
+        return summary
+
+    def run(self, processes=None):
+        """Run all members, in given number of processes.
+
+        By default, one process per CPU is used. If processes is 1,
+        the members are run one after the other in this process.
+        """
+        global _ensemble
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = max(1, min(processes, len(self.members)))
+        logging.info('Running %i ensemble members in %i processes' %
+                     (len(self.members), processes))
+        start_time = datetime.now()
+        self.results = [None]*len(self.members)
+        self.density = {}  # Sum of density of all members, by time
+        if processes == 1:
+            summaries = ((i, self.run_member(i))
+                         for i in range(len(self.members)))
+            self.aggregate(summaries)
+        else:
+            _ensemble = self
+            pool = multiprocessing.Pool(processes, _init_process)
+            try:
+                self.aggregate(pool.imap_unordered(
+                    _run_member, range(len(self.members))))
+            finally:
+                pool.close()
+                pool.join()
+                _ensemble = None
+        logging.info('Ensemble finished in %s' %
+                     (datetime.now() - start_time))
+
+    def aggregate(self, summaries):
+        """Keep summaries of members, except density, which is summed."""
+        for index, summary in summaries:
+            logging.info('Ensemble member %i finished' % index)
+            density = summary.pop('density', None)
+            if density is not None:
+                for i, time in enumerate(summary['times']):
+                    if time in self.density:
+                        self.density[time] += density[i]
+                    else:
+                        self.density[time] = density[i].astype(np.int64)
+            self.results[index] = summary
+
+    def times(self):
+        """Sorted list of output times of all members."""
+        times = set()
+        for summary in self.results:
+            times.update(summary['times'])
+        return sorted(times)
+
+    def probability(self, time=None):
+        """Fraction of all elements of all members in each grid cell.
+
+        Returned for the given output time, or the last time if not given.
+        """
+        if len(self.density) == 0:
+            raise ValueError('No density available, lon_bins and lat_bins '
+                             'must be given to calculate density')
+        if time is None:
+            time = max(self.density.keys())
+        num_elements = sum([len(summary['lon']) for summary in self.results
+                            if time in summary['times']])
+        return self.density[time]/float(num_elements)
+
+    def status_budget(self):
+        """Mean number of elements of each status, at each output time.
+
+        Returns times and dictionary of arrays, by status category.
+        """
+        times = self.times()
+        categories = []
+        for summary in self.results:
+            for category in summary['status_counts']:
+                if category not in categories:
+                    categories.append(category)
+        budget = {category: np.zeros(len(times)) for category in categories}
+        num_members = np.zeros(len(times))
+        for summary in self.results:
+            ind = [times.index(t) for t in summary['times']]
+            num_members[ind] += 1
+            for category, counts in summary['status_counts'].iteritems():
+                budget[category][ind] += counts
+        for category in categories:
+            budget[category] = budget[category]/np.maximum(num_members, 1)
+        return times, budget
@@ -0,0 +1,106 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import numpy as np
+
+
+class History(object):
+    """Columnar storage of element properties and environment over time.
+
+    Each variable is stored in a separate array of shape (elements, times),
+    in Fortran order so that the values of one output time are contiguous.
+    Validity (whether a value has been stored) is kept in one boolean array
+    common to all variables, as all variables of an element are stored
+    together (see OpenDriftSimulation.state_to_buffer).
+
+    As for a masked structured array, history['lon'] returns a masked
+    array. Note however that indexing along elements and/or time, e.g.
+    history[:, 0:10], returns a new History with a subset, and not a
+    masked structured array; to_masked_array() gives the latter.
+    History is also used for history imported from file.
+    """
+
+    def __init__(self, shape, dtype, data=None, valid=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if data is None:
+            data = {name: np.zeros(self.shape, dtype=self.dtype[name],
+                                   order='F')
+                    for name in self.dtype.names}
+        if valid is None:
+            valid = np.zeros(self.shape, dtype=np.bool, order='F')
+        self.data = data
+        self.valid = valid
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            if key not in self.data:
+                raise ValueError('no field of name %s' % key)
+            return np.ma.array(self.data[key], mask=~self.valid, copy=False)
+        # Indexing along elements and/or time
+        valid = self.valid[key]
+        data = {name: self.data[name][key] for name in self.data}
+        return History(valid.shape, self.dtype, data, valid)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def store(self, element_ind, time_ind, name, values):
+        """Store values of a variable for given elements and time(s).
+
+        The values are flagged as valid by validate(), to be called after
+        all variables are stored.
+        """
+        self.data[name][element_ind, time_ind] = values
+
+    def validate(self, element_ind, time_ind):
+        """Flag values for given elements and time(s) as valid."""
+        self.valid[element_ind, time_ind] = True
+
+    def reset(self):
+        """Flag all values as invalid, e.g. after export to file."""
+        self.valid[:] = False
+
+    def to_masked_array(self):
+        """Return copy of data as masked structured array."""
+        array = np.ma.array(np.zeros(self.shape, dtype=self.dtype),
+                            mask=True)
+        for name in self.dtype.names:
+            array[name] = self[name]
+        return array
+
+    @classmethod
+    def combine(cls, histories, rows):
+        """Return History with elements of all given histories.
+
+        rows is a list with the indices of the elements of each history
+        in the combined history. The histories must have the same dtype,
+        but may have different numbers of times, in which case missing
+        times are invalid.
+        """
+        num_elements = sum([h.shape[0] for h in histories])
+        num_times = max([h.shape[1] for h in histories])
+        history = cls((num_elements, num_times), histories[0].dtype)
+        for h, ind in zip(histories, rows):
+            for name in history.data:
+                history.data[name][ind, 0:h.shape[1]] = h.data[name]
+            history.valid[ind, 0:h.shape[1]] = h.valid
+        return history
+
+    def nbytes(self):
+        """Memory size (bytes) of stored data."""
+        return self.valid.nbytes + sum([d.nbytes for d in
+                                        self.data.values()])
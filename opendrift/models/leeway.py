@@ -263,11 +263,12 @@ class Leeway(OpenDriftSimulation):
         costh = np.cos(winddir)
         y_leeway = downwind_leeway*costh+crosswind_leeway*sinth
         x_leeway = -downwind_leeway*sinth+crosswind_leeway*costh
-        self.update_positions(-x_leeway, y_leeway)
+        self.add_velocity(-x_leeway, y_leeway, source='leeway')
 
         # Move particles with ambient current
-        self.update_positions(self.environment.x_sea_water_velocity,
-                              self.environment.y_sea_water_velocity)
+        self.add_velocity(self.environment.x_sea_water_velocity,
+                          self.environment.y_sea_water_velocity,
+                          source='ocean_current')
 
         # Jibe elements randomly according to given probability
         jp_per_timestep = self.elements.jibeProbability * \
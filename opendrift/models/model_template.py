@@ -118,15 +118,19 @@ class ModelTemplate(OpenDriftSimulation):
         # Horizontal position of the particles (lon, lat) are the
         # only properties which should not be modified directly/freely.
         # Due to the need to correct for the curvature of the coordinate
-        # systems, a dedicated function (self.update_positions() should be
-        # used instead, with x- and y-velocity as arguments:
+        # systems, a dedicated function (self.add_velocity() should be
+        # used instead, with x- and y-velocity as arguments. The velocities
+        # are summed, and particles are moved once at end of the time step.
         # E.g. to simply move particles with ambient current:
-        # self.update_positions(self.environment.x_sea_water_velocity,
-        #                       self.environment.y_sea_water_velocity)
+        # self.add_velocity(self.environment.x_sea_water_velocity,
+        #                   self.environment.y_sea_water_velocity,
+        #                   source='ocean_current')
         # E.g. to move particles with 3 percent of the wind speed:
         # wind_factor = 0.03
-        # self.update_positions(self.environment.x_wind*wind_factor,
-        #                      self.environment.y_wind*wind_factor)
+        # self.add_velocity(self.environment.x_wind*wind_factor,
+        #                   self.environment.y_wind*wind_factor,
+        #                   source='wind_drift')
+        # To move particles immediately, use self.update_positions()
 
         # If particles need to be deactived (e.g. when hitting land),
         # the special function self.deactivate_elements() should be used:
@@ -14,6 +14,7 @@
 #
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
+import functools
 import numpy as np
 import logging
 from scipy.interpolate import interp1d
@@ -21,6 +22,27 @@ from opendrift.models.basemodel import OpenDriftSimulation
 from opendrift.elements import LagrangianArray
 
 
+def resample_profiles(profiles, zi):
+    """Profiles at given fractional indices of their first dimension.
+
+    Values are interpolated linearly between levels, as in the binned
+    random walk of vertical_mixing, where the first level is used for
+    NaN indices (outside of profiles). One row is added at the end,
+    with the values outside of profiles.
+    """
+    profiles = np.ma.getdata(profiles)
+    upper = np.floor(zi)
+    upper[np.isnan(upper)] = 0
+    upper = np.maximum(upper.astype(np.int), 0)
+    lower = np.minimum(upper + 1, profiles.shape[0] - 1)
+    weight_upper = 1 - (zi - upper)
+    weight_upper[np.isnan(weight_upper)] = 1
+    weight_upper = weight_upper[:, np.newaxis]
+    resampled = profiles[upper, :]*weight_upper + \
+        profiles[lower, :]*(1 - weight_upper)
+    return np.vstack((resampled, profiles[0:1, :]))
+
+
 # Defining the oil element properties
 class Lagrangian3DArray(LagrangianArray):
     """Extending LagrangianArray for elements moving in 3 dimensions
@@ -50,6 +72,17 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
 
     max_speed = 1  # m/s
 
+    # Maximum number of values of profiles resampled by the mixing kernel
+    mixing_table_max_size = 10000000
+
+    # Maximum number of random numbers drawn at once by the mixing kernel.
+    # Numbers for at least one mixing step are always drawn at once.
+    mixing_random_block_size = 1000000
+
+    # Maximum distance (in half bins) of elements from the grid of half
+    # bins, for which the mixing kernel uses the resampled profiles
+    mixing_grid_tolerance = 1e-3
+
     def __init__(self, *args, **kwargs):
 
         configspec_oceandrift3D = '''
@@ -63,6 +96,7 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
                 verticalresolution = float(min=0.01, max=10, default = 2.)
                 diffusivitymodel = option('environment', 'stepfunction', 'windspeed_Sundby1983', 'gls_tke', default='environment')
                 TSprofiles = boolean(default=True)
+                fast_kernel = boolean(default=True)
                 '''
         self._add_configstring(configspec_oceandrift3D)
 
@@ -137,7 +171,7 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
         #avoid that elements are below bottom
         bottom = np.where(self.elements.z < Zmin)
         if len(bottom[0]) > 0:
-            self.elements.z[bottom] = np.round(Zmin/dz)*dz + dz/2.
+            self.elements.z[bottom] = np.round(Zmin[bottom]/dz)*dz + dz/2.
 
         # Eventual model specific preparions
         self.prepare_vertical_mixing()
@@ -181,10 +215,6 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
             Sprofiles = None
             Tprofiles = None
 
-        # prepare vertical interpolation coordinates
-        z_i = range(Kprofiles.shape[0])
-        z_index = interp1d(-self.environment_profiles['z'],
-                           z_i, bounds_error=False)
         # internal loop for fast time step of vertical mixing model
         # binned random walk needs faster time step compared
         # to horizontal advection
@@ -193,6 +223,17 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
         logging.debug('turbulent diffusion with binned random walk scheme')
         logging.debug('using ' + str(ntimes_mix) + ' fast time steps of dt=' +
                       str(dt_mix) + 's')
+
+        if self.get_config('turbulentmixing:fast_kernel') is True:
+            self.vertical_mixing_kernel(Kprofiles, Tprofiles, Sprofiles,
+                                        Zmin, dz, dt_mix, ntimes_mix)
+            self.timer_end('main loop:updating elements:vertical mixing')
+            return
+
+        # prepare vertical interpolation coordinates
+        z_i = range(Kprofiles.shape[0])
+        z_index = interp1d(-self.environment_profiles['z'],
+                           z_i, bounds_error=False)
         for i in range(0, ntimes_mix):
             #remember which particles belong to the exact surface
             surface = self.elements.z == 0
@@ -258,7 +299,7 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
             #avoid that elements are below bottom
             bottom = np.where(self.elements.z < Zmin)
             if len(bottom[0]) > 0:
-                self.elements.z[bottom] = np.round(Zmin/dz)*dz + dz/2.
+                self.elements.z[bottom] = np.round(Zmin[bottom]/dz)*dz + dz/2.
 
             # Call surface interaction:
             # reflection at surface or formation of slick and wave mixing if implemented for this class
@@ -266,6 +307,173 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
 
         self.timer_end('main loop:updating elements:vertical mixing')
 
+    def vertical_mixing_kernel(self, Kprofiles, Tprofiles, Sprofiles,
+                               Zmin, dz, dt_mix, ntimes_mix):
+        """Binned random walk of elements, in ntimes_mix steps of dt_mix
+
+            Same scheme as the inner loop of vertical_mixing, but the
+            mapping from depth to index of the profiles is prepared once,
+            work arrays are allocated once, and random numbers are drawn
+            for several steps at a time.
+
+            Elements are kept on a grid of half bins (dz/2) during mixing:
+            bin centres, the surface, and the bottom position. Profiles
+            are therefore resampled onto this grid once, so that K at z
+            and z-dz (and thus the gradient of K) is found by indexing
+            only. If the resampled profiles would be larger than
+            mixing_table_max_size, K is instead interpolated at each step,
+            as it is for steps where any element is off the grid, e.g.
+            if moved by surface_interaction to another depth. Tprofiles
+            and Sprofiles are resampled in the same way, and are passed
+            to update_terminal_velocity with a z_index giving the row
+            of the resampled profiles, or as given with the z_index of
+            the original profiles for steps with elements off the grid.
+        """
+        num_levels, num_elements = Kprofiles.shape
+
+        # depth to (fractional) profile index, NaN outside profiles
+        profile_depth = -np.asarray(self.environment_profiles['z'],
+                                    dtype=np.float64)
+        order = np.argsort(profile_depth)
+        z_index = functools.partial(
+            np.interp, xp=profile_depth[order],
+            fp=np.arange(num_levels, dtype=np.float64)[order],
+            left=np.nan, right=np.nan)
+
+        Kflat = np.ma.getdata(Kprofiles).astype(np.float64).ravel()
+
+        # Grid of half bins, down to the deepest profile level or sea
+        # floor, with one row of margin as depths are float32
+        half_bin = dz/2.
+        max_depth = min(profile_depth.max(), np.max(-Zmin) + dz)
+        num_rows = int(np.floor(max_depth/half_bin)) + 2
+        use_grid = (num_rows + 1)*num_elements <= self.mixing_table_max_size
+        if use_grid:
+            logging.debug('Resampling profiles onto %i levels of %s m' %
+                          (num_rows, half_bin))
+            grid_depth = np.arange(num_rows)*half_bin
+            Kgrid = resample_profiles(Kprofiles, z_index(grid_depth)).ravel()
+            Tgrid = Sgrid = None
+            if Tprofiles is not None:
+                Tgrid = resample_profiles(Tprofiles, z_index(grid_depth))
+            if Sprofiles is not None:
+                Sgrid = resample_profiles(Sprofiles, z_index(grid_depth))
+
+            def grid_z_index(depth):
+                """Grid row of depth, last row for outside of profiles"""
+                row = np.asarray(depth, dtype=np.float64)/half_bin
+                row[~((row >= 0) & (row <= num_rows - 1))] = num_rows
+                return row
+
+        # work arrays, for K at depth z and z-dz
+        columns = np.tile(np.arange(num_elements), 2)
+        depth = np.empty(2*num_elements)
+        row = np.empty(2*num_elements)
+        upper = np.empty(2*num_elements, dtype=np.int64)
+        lower = np.empty(2*num_elements, dtype=np.int64)
+        weight_upper = np.empty(2*num_elements)
+        K = np.empty(2*num_elements)
+        K_lower = np.empty(2*num_elements)
+        p = np.empty(num_elements)
+        q = np.empty(num_elements)
+        wdz = np.empty(num_elements)
+
+        z_bottom = np.round(Zmin/dz)*dz + dz/2.
+        z_bottom = z_bottom*np.ones(num_elements)
+        probability_factor = dt_mix/(2.0*dz*dz)
+        block = max(1, min(ntimes_mix,
+                           self.mixing_random_block_size // num_elements))
+
+        for i in range(0, ntimes_mix):
+            if i % block == 0:
+                random_numbers = np.random.random(
+                    (min(block, ntimes_mix - i), num_elements))
+            z = self.elements.z
+            #remember which particles belong to the exact surface
+            surface = z == 0
+
+            # depth z (first half) and z-dz (second half)
+            np.negative(z, out=depth[:num_elements])
+            np.subtract(dz, z, out=depth[num_elements:])
+            on_grid = False
+            if use_grid:
+                np.divide(depth, half_bin, out=row)
+                np.rint(row, out=weight_upper)
+                np.subtract(row, weight_upper, out=K_lower)
+                on_grid = np.abs(K_lower).max() <= self.mixing_grid_tolerance
+                if not on_grid:
+                    logging.debug('Elements are off the grid of half bins, '
+                                  'interpolating in profiles')
+
+            # update terminal velocity according to environmental variables
+            if self.get_config('turbulentmixing:TSprofiles') is True:
+                if on_grid:
+                    self.update_terminal_velocity(Tprofiles=Tgrid,
+                                                  Sprofiles=Sgrid,
+                                                  z_index=grid_z_index)
+                else:
+                    self.update_terminal_velocity(Tprofiles=Tprofiles,
+                                                  Sprofiles=Sprofiles,
+                                                  z_index=z_index)
+            else:
+                self.update_terminal_velocity()
+            np.multiply(self.elements.terminal_velocity, dz, out=wdz)
+
+            # diffusivity K at depth z and z-dz
+            if on_grid:
+                weight_upper[~((weight_upper >= 0) &
+                               (weight_upper < num_rows))] = num_rows
+                upper[:] = weight_upper
+                np.take(Kgrid, upper*num_elements + columns, out=K)
+            else:
+                zi = z_index(depth)
+                np.floor(zi, out=weight_upper)
+                weight_upper[np.isnan(weight_upper)] = 0
+                upper[:] = weight_upper
+                np.minimum(upper + 1, num_levels - 1, out=lower)
+                np.subtract(zi, weight_upper, out=weight_upper)
+                np.subtract(1, weight_upper, out=weight_upper)
+                weight_upper[np.isnan(weight_upper)] = 1
+                np.take(Kflat, upper*num_elements + columns, out=K)
+                np.take(Kflat, lower*num_elements + columns, out=K_lower)
+                K *= weight_upper
+                K_lower *= (1 - weight_upper)
+                K += K_lower
+
+            # calculate rise/sink probability dependent on K and w
+            np.multiply(K[:num_elements], 2.0, out=p)
+            p += wdz
+            p *= probability_factor  # probability to rise
+            np.multiply(K[num_elements:], 2.0, out=q)
+            q -= wdz
+            q *= probability_factor  # probability to sink
+
+            # check if probabilities are reasonable or wrong; which can happen if K is very high (K>0.1)
+            wrong = p+q > 1.00002
+            if wrong.any():
+                logging.info('WARNING! '+str(wrong.sum())+' elements have p+q>1; you might need a smaller mixing time step')
+                # fixing p and q by scaling them to assure p+q<1:
+                norm = p[wrong] + q[wrong]
+                p[wrong] /= norm
+                q[wrong] /= norm
+
+            # use probabilities to mix some particles up or down
+            RandKick = random_numbers[i % block]
+            z[RandKick < p] += dz  # move to layer above
+            z[RandKick > 1.0 - q] -= dz  # move to layer underneath
+
+            # put the particles that belong to the surface slick (if present) back to the surface
+            z[surface] = 0.
+
+            #avoid that elements are below bottom
+            bottom = z < Zmin
+            if bottom.any():
+                z[bottom] = z_bottom[bottom]
+
+            # Call surface interaction:
+            # reflection at surface or formation of slick and wave mixing if implemented for this class
+            self.surface_interaction(dt_mix)
+
     def plot_vertical_distribution(self):
         """Function to plot vertical distribution of particles"""
         import matplotlib.pyplot as plt
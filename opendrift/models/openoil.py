@@ -128,6 +128,10 @@ class OpenOil(OpenDriftSimulation):
     ''' % (oil_types, default_oil)
 
 
+    # Range of sea water temperature [K] for which viscosity and density
+    # of NOAA oiltypes are tabulated at the start of a run
+    noaa_table_temperature_range = [269., 313.]
+
     def __init__(self, weathering_model='default', *args, **kwargs):
 
         self._add_configstring(self.configspec)
@@ -321,7 +325,8 @@ class OpenOil(OpenDriftSimulation):
             else:
                 sigma_u = 0*self.environment.x_wind
                 sigma_v = 0*self.environment.x_wind
-            self.update_positions(sigma_u, sigma_v)
+            self.add_velocity(sigma_u, sigma_v,
+                              source='current_uncertainty')
 
             # Wind
             wind_drift_factor = self.get_config('drift:wind_drift_factor')
@@ -334,7 +339,8 @@ class OpenOil(OpenDriftSimulation):
             else:
                 sigma_u = 0*self.environment.x_wind
                 sigma_v = 0*self.environment.x_wind
-            self.update_positions(sigma_u, sigma_v)
+            self.add_velocity(sigma_u, sigma_v,
+                              source='wind_uncertainty')
 
     def oil_weathering(self):
         self.elements.age_seconds += self.time_step.total_seconds()
@@ -377,12 +383,58 @@ class OpenOil(OpenDriftSimulation):
 
             self.oil_water_interfacial_tension = \
                 self.oiltype.oil_water_surface_tension()[0]
+
+            self.noaa_property_table = self.oil_property_table(
+                np.arange(self.noaa_table_temperature_range[0],
+                          self.noaa_table_temperature_range[1] + 0.05,
+                          0.1))
             logging.info('Oil-water surface tension is %f Nm' % 
                          self.oil_water_interfacial_tension)
         else:
             logging.info('Using default oil-water tension of 0.03Nm')
             self.oil_water_interfacial_tension = 0.03
 
+    def oil_property_table(self, temperature):
+        """Viscosity and density of the NOAA oiltype at given temperatures.
+
+        Properties are calculated one temperature at a time, and are
+        returned as a tuple of arrays (temperature, viscosity, density).
+        """
+        temperature = np.atleast_1d(temperature).astype(np.float64)
+        try:  # Old version of OilLibrary
+            viscosity = self.oiltype.kvis_at_temp(temperature)
+            density = [self.oiltype.density_at_temp(t) for t in temperature]
+        except:  # New version of OilLibrary
+            viscosity = [self.oiltype.get_viscosity(t) for t in temperature]
+            density = [self.oiltype.get_density(t) for t in temperature]
+        return (temperature,
+                np.asarray(viscosity, dtype=np.float64).ravel(),
+                np.asarray(density, dtype=np.float64).ravel())
+
+    def oil_properties_at_temperature(self, temperature):
+        """Viscosity and density of the NOAA oiltype at given temperatures.
+
+        Properties are interpolated linearly from the table calculated in
+        prepare_run, and calculated from the oiltype only for temperatures
+        outside the table.
+        """
+        temperature = np.atleast_1d(temperature)
+        if not hasattr(self, 'noaa_property_table'):
+            return self.oil_property_table(temperature)[1:]
+        table_temperature, table_viscosity, table_density = \
+            self.noaa_property_table
+        viscosity = np.interp(temperature, table_temperature,
+                              table_viscosity)
+        density = np.interp(temperature, table_temperature, table_density)
+        outside = ((temperature < table_temperature[0]) |
+                   (temperature > table_temperature[-1]))
+        if outside.any():
+            logging.debug('%s elements with temperature outside table '
+                          'of oil properties' % np.sum(outside))
+            viscosity[outside], density[outside] = \
+                self.oil_property_table(temperature[outside])[1:]
+        return viscosity, density
+
     def oil_weathering_noaa(self):
         '''Oil weathering scheme adopted from NOAA PyGNOME model:
         https://github.com/NOAA-ORR-ERD/PyGnome
@@ -395,20 +447,9 @@ class OpenOil(OpenDriftSimulation):
         #########################################################
         # Update density and viscosity according to temperature
         #########################################################
-        try:  # Old version of OilLibrary
-            self.elements.viscosity = \
-                self.oiltype.kvis_at_temp(
-                    self.environment.sea_water_temperature)
-            self.elements.density = np.atleast_1d([
-                self.oiltype.density_at_temp(t) for t in 
-                    self.environment.sea_water_temperature])
-        except:  # New version of OilLibrary
-            self.elements.viscosity = np.array(
-                [self.oiltype.get_viscosity(t) for t in
-                 self.environment.sea_water_temperature])
-            self.elements.density = np.array(
-                [self.oiltype.get_density(t) for t in
-                 self.environment.sea_water_temperature])
+        self.elements.viscosity, self.elements.density = \
+            self.oil_properties_at_temperature(
+                self.environment.sea_water_temperature)
 
         if self.get_config('processes:evaporation') is True:
             self.evaporation_noaa()
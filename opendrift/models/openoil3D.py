@@ -91,6 +91,10 @@ class OpenOil3D(OpenDrift3DSimulation, OpenOil):  # Multiple inheritance
 
     max_speed = 1.0  # m/s
 
+    # Random numbers for mixing are drawn one step at a time, as
+    # surface_interaction draws random numbers for entrainment in between
+    mixing_random_block_size = 0
+
     # Read oil types from file (presently only for illustrative effect)
     oil_types = str([str(l.strip()) for l in open(
                     os.path.dirname(os.path.realpath(__file__)) +
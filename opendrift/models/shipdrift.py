@@ -25,6 +25,7 @@ import numpy as np
 import scipy
 
 from opendrift.models.basemodel import OpenDriftSimulation
+from opendrift.models.history import History
 from opendrift.elements import LagrangianArray
 
 
@@ -90,6 +91,12 @@ class ShipDrift(OpenDriftSimulation):
     max_speed = 2  # m/s
     winwav_angle = 20  # Angular offset in degrees
 
+    # Frequencies of wave spectrum, and start of interval 3
+    # where the wave force coefficient is constant
+    wave_force_domega = (12.0 - 2.25)/(100 - 1)
+    wave_force_omega = 2.25 + np.arange(100)*wave_force_domega
+    wave_force_omega_interval3 = 7.0
+
     def __init__(self, *args, **kwargs):
 
         # Read ship properties
@@ -125,12 +132,34 @@ class ShipDrift(OpenDriftSimulation):
         self.wforce_interpolator_F = scipy.interpolate.LinearNDInterpolator(
             (wi_omega.ravel(), wi_BL.ravel(), wi_DL.ravel()),
              self.wforce['F'].ravel())
-        self.wforce_interpolator_D = scipy.interpolate.LinearNDInterpolator(
-            (wi_omega.ravel(), wi_BL.ravel(), wi_DL.ravel()),
-             self.wforce['D'].ravel())
 
         super(ShipDrift, self).__init__(*args, **kwargs)
 
+    def wave_force_coefficient(self, bl, dl):
+        """Wave force coefficient for given ratios of beam and draft to
+        length, at each frequency of wave_force_omega (bins x ships)."""
+        omega = self.wave_force_omega
+        interval2 = omega < self.wave_force_omega_interval3
+        f = 0.5*np.ones((len(omega), len(bl)))  # Interval 3
+        f[interval2, :] = self.wforce_interpolator_F(
+            omega[interval2, np.newaxis], bl, dl)
+        return f
+
+    def prepare_run(self):
+        # The dimensions of ships do not change, hence wave force
+        # coefficients are interpolated once, and indexed by element ID
+        elements = [e for e in [self.elements, self.elements_scheduled]
+                    if len(e) > 0]
+        num_elements = max([e.ID.max() for e in elements])
+        logging.debug('Interpolating wave force coefficients for %i ships'
+                      % num_elements)
+        self.wave_force_coefficients = np.zeros(
+            (len(self.wave_force_omega), num_elements))
+        for e in elements:
+            self.wave_force_coefficients[:, e.ID - 1] = \
+                self.wave_force_coefficient(e.beam/e.length,
+                                            e.draft/e.length)
+
     def seed_elements(self, *args, **kwargs):
         
         num = kwargs['number']
@@ -182,12 +211,11 @@ class ShipDrift(OpenDriftSimulation):
 
         Tm = self.wave_period()
         Hs = self.significant_wave_height()
-        dl = self.elements.draft/self.elements.length
-        bl = self.elements.beam/self.elements.length
 
         # Simply move particles with ambient current
-        self.update_positions(self.environment.x_sea_water_velocity,
-                              self.environment.y_sea_water_velocity)
+        self.add_velocity(self.environment.x_sea_water_velocity,
+                          self.environment.y_sea_water_velocity,
+                          source='ocean_current')
 
         # Wind force
         rho_air = 1.25  # to be checked
@@ -205,40 +233,23 @@ class ShipDrift(OpenDriftSimulation):
 
         # Wave force
         rho_water = 1025
-        NSPEC = 100
-        ommin2 = 2.25
-        ommin3 = 7.0
-        ommax = 12.0
-        dom = (ommax-ommin2)/(NSPEC-1)
-        F_wave = np.zeros(self.num_elements_active())  # For each ship
+        omega = self.wave_force_omega
+        dom = self.wave_force_domega
         scale1 = np.sqrt(9.81/self.elements.length)
 
+        # Wave spectrum (bins x ships)
         tmp = np.power(2.0*np.pi/Tm, 4)
         d = tmp*Hs*Hs/(4*np.pi)
         b = tmp/np.pi
-        s = np.zeros((NSPEC, self.num_elements_active()))
-        for i in range(NSPEC):
-            omi = ommin2 + i*dom
-            omi = omi*scale1
-            s[i, :] = d * np.exp(-b/np.power(omi, 4)) / np.power(omi, 5)  # m2s
-
-        f2 = 0.0
-        d2 = 0.0
-        for i in range(NSPEC):
-            omi = ommin2 + i*dom
-            f1 = f2
-            d1 = d2
-            #print omi - ommin3, 'should be positive'
-            #print omi
-            if (omi < ommin3):
-                f2 = self.wforce_interpolator_F(omi, bl, dl)
-                d2 = self.wforce_interpolator_D(omi, bl, dl)
-            else:
-                # Interval 3
-                f2 = 0.5
-                d2 = 4.0*omi*f2
-
-            F_wave = F_wave + 0.5*(f1+f2)*dom*scale1*np.power(s[i,:], 2)
+        omi = omega[:, np.newaxis]*scale1
+        omi4 = np.square(np.square(omi))
+        s = d * np.exp(-b/omi4) / (omi4*omi)  # m2s
+
+        # Trapezoidal integration of wave force over spectrum
+        f = self.wave_force_coefficients[:, self.elements.ID - 1]
+        f_mean = 0.5*f
+        f_mean[1:, :] += 0.5*f[:-1, :]
+        F_wave = np.sum(f_mean*np.square(s), axis=0)*dom*scale1
 
         F_wave = F_wave*rho_water*9.81*self.elements.length
         beta2 = rho_water*np.sqrt(9.81*self.elements.length)
@@ -292,7 +303,7 @@ class ShipDrift(OpenDriftSimulation):
         # Finally advect according to wind-wave forces
         velocity_u = uw_tot*np.cos(uw_dir)
         velocity_v = uw_tot*np.sin(uw_dir)
-        self.update_positions(velocity_u, velocity_v)
+        self.add_velocity(velocity_u, velocity_v, source='wind_wave_drift')
 
         # Stranding
         self.deactivate_elements(self.environment.land_binary_mask == 1,
@@ -321,9 +332,7 @@ class ShipDrift(OpenDriftSimulation):
             self.history_metadata[env_var] = {}
         history_dtype = np.dtype(history_dtype_fields)
 
-        self.history = np.ma.array(
-	        np.zeros([num_elements, num_timesteps]),
-            dtype=history_dtype, mask=[True])
+        self.history = History((num_elements, num_timesteps), history_dtype)
 
         self.steps_output = num_timesteps
         self.steps = num_timesteps
@@ -337,5 +346,6 @@ class ShipDrift(OpenDriftSimulation):
             l = line.split()
             lon = np.float(l[2])
             lat = np.float(l[3])
-            self.history['lon'][0, i] = lon
-            self.history['lat'][0, i] = lat
+            self.history.store(0, i, 'lon', lon)
+            self.history.store(0, i, 'lat', lat)
+            self.history.validate(0, i)
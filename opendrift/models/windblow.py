@@ -35,5 +35,5 @@ class WindBlow(OpenDriftSimulation):
     def update(self):
 
         # Simply move particles with ambient wind
-        self.update_positions(self.environment.x_wind,
-                              self.environment.y_wind)
+        self.add_velocity(self.environment.x_wind, self.environment.y_wind,
+                          source='wind')
@@ -16,16 +16,22 @@
 
 import sys
 import logging
-import copy
+import threading
+import itertools
 from inspect import currentframe, getframeinfo
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 from abc import abstractmethod, ABCMeta
 
-from scipy.interpolate import LinearNDInterpolator
 from scipy.ndimage import map_coordinates
 import numpy as np
 
 from interpolation import ReaderBlock
+import blockcache
+from blockcache import ReaderBlockCache
+from curvilinear import get_curvilinear_grid
+from rotation import RotationAngleField, rotate
+from landfill import LandFillCache
+import metadatacache
 
 try:
     import pyproj  # Import pyproj
@@ -38,6 +44,9 @@ except:
                           ' please install from '
                           'https://code.google.com/p/pyproj/')
 
+# Numbering of reader instances, see BaseReader.data_source()
+instance_counter = itertools.count()
+
 # Som valid (but extreme) ranges for checking that values are reasonable
 standard_names = {
     'x_wind': {'valid_min': -50, 'valid_max': 50},
@@ -54,6 +63,31 @@ vector_pairs_xy = [
     ]
 
 
+def nan_filled(values):
+    """Return copy of (masked) array as float32, with NaN where masked."""
+    filled = np.array(np.ma.getdata(values), dtype=np.float32)
+    mask = np.ma.getmask(values)
+    if mask is not np.ma.nomask:
+        filled[mask] = np.nan
+    return filled
+
+
+def replace_invalid_values(var, values):
+    """Replace values outside valid range of variable with NaN, in place."""
+    if var not in standard_names:
+        return
+    with np.errstate(invalid='ignore'):
+        invalid = ((values < standard_names[var]['valid_min']) |
+                   (values > standard_names[var]['valid_max']))
+    num_invalid = np.count_nonzero(invalid)
+    if num_invalid > 0:
+        logging.warning('%i invalid values found for %s (allowed range: '
+                        '[%s, %s]), replacing with NaN' %
+                        (num_invalid, var, standard_names[var]['valid_min'],
+                         standard_names[var]['valid_max']))
+        values[invalid] = np.nan
+
+
 class fakeproj():
     # For readers with unprojected domain, we emulate a
     # pyproj class with needed functions
@@ -81,6 +115,23 @@ class BaseReader(object):
 
     verticalbuffer = 1  # To be overridden by application as needed
 
+    prefetch = False  # Set to True to read the next time block of data
+                      # in a background thread while the model is updated
+
+    block_cache_bytes = 0  # Memory size of cache of previously read
+                           # blocks, see set_block_cache_size()
+
+    cache_dir = None  # Folder to store metadata of files and lookup
+                      # structures of unprojected grids, for fast startup
+
+    rotation_grid_nodes = 200  # Maximum number of nodes along each axis
+                               # of cached grid of vector rotation angles.
+                               # If 0, angles are calculated at each position
+
+    fast_time_interpolation = True  # Interpolated values are returned as
+                                    # float32 arrays with NaN for missing
+                                    # values. If False, as masked arrays
+
     start_time = None
 
     # Mapping variable names, e.g. from east-north to x-y, temporarily
@@ -113,9 +164,23 @@ class BaseReader(object):
     def __init__(self):
         # Common constructor for all readers
 
+        # Unique number of reader, identifying data without a file
+        self.instance_number = next(instance_counter)
+
         # Dictionaries to store blocks of data for reuse (buffering)
         self.var_block_before = {}  # Data for last timestep before present
         self.var_block_after = {}   # Data for first timestep after present
+        self.var_block_prefetch = {}  # Blocks being read in background
+        self.var_block_prefetch_time = {}  # Last requested time
+        # Datasets are not thread safe, hence only one read at a time
+        self.get_variables_lock = threading.Lock()
+        # Blocks of data which may be used again, e.g. by
+        # Runge-Kutta scheme or repeated simulations
+        self.block_cache = ReaderBlockCache(self.block_cache_bytes)
+        # Rotation angles of vectors, by SRS to rotate to
+        self.rotation_fields = {}
+        # Fill of land (masked) cells, by land mask of blocks
+        self.land_fill_cache = LandFillCache()
 
         self.always_valid = False  # Set to True if a single field should
                                    # be valid at all times
@@ -131,20 +196,10 @@ class BaseReader(object):
                 self.proj4 = 'None'
                 self.proj = fakeproj()
                 self.projected = False
-                logging.info('Making Splines for lon,lat to x,y conversion...')
-
-                block_x, block_y = np.meshgrid(
-                    np.arange(self.xmin, self.xmax + 1, 1),
-                    np.arange(self.ymin, self.ymax + 1, 1))
-
-                # Making interpolator (lon, lat) -> x
-                self.spl_x = LinearNDInterpolator((np.ravel(self.lon),
-                                                   np.ravel(self.lat)),
-                                                  np.ravel(block_x),
-                                                  fill_value=np.nan)
-                # Reusing x-interpolator (deepcopy) with data for y
-                self.spl_y = copy.deepcopy(self.spl_x)
-                self.spl_y.values[:, 0] = np.ravel(block_y)
+                # Lookup structure for lon,lat to x,y conversion
+                self.grid = get_curvilinear_grid(
+                    self.lon, self.lat, self.xmin, self.ymin,
+                    cache_dir=self.cache_dir)
 
         # Check if there are holes in time domain
         if self.start_time is not None and len(self.times) > 1:
@@ -185,6 +240,87 @@ class BaseReader(object):
                           'a maximum average speed of %g m/s.' %
                           (self.buffer, self.name, max_speed))
 
+    def set_block_cache_size(self, max_bytes=None, shared=False):
+        '''Set maximum memory size (bytes) of cache of data blocks
+
+        If shared is True, blocks are instead stored in the process-wide
+        cache, where they are available to all readers of the same data
+        source (e.g. file), also from other simulations. The size of the
+        shared cache is common to all readers using it, and is set with
+        blockcache.set_shared_block_cache_size.
+        '''
+        if shared is True:
+            if max_bytes is not None:
+                raise ValueError('Size of shared block cache is set with '
+                                 'blockcache.set_shared_block_cache_size')
+            self.block_cache = blockcache.shared_block_cache
+            if self.block_cache.max_bytes <= 0:
+                logging.info('Shared block cache has size 0, see '
+                             'blockcache.set_shared_block_cache_size')
+            logging.debug('Reader %s uses shared block cache' % self.name)
+            return
+        if max_bytes is None:
+            max_bytes = self.block_cache_bytes
+        if self.block_cache is blockcache.shared_block_cache:
+            self.block_cache = ReaderBlockCache()
+        self.block_cache.max_bytes = max_bytes
+        if max_bytes <= 0:
+            self.block_cache.clear()
+        logging.debug('Block cache of reader %s set to %s bytes' %
+                      (self.name, max_bytes))
+
+    def reopen(self):
+        '''Prepare reader for use in a new (forked) process
+
+        Blocks being read in background are discarded, and files are
+        opened again, as file handles shall not be shared between
+        processes. Data already read (e.g. cached blocks) is kept.
+        '''
+        self.var_block_prefetch = {}
+        self.var_block_prefetch_time = {}
+        self.get_variables_lock = threading.Lock()
+        if hasattr(self, 'open_dataset'):
+            self.open_dataset()
+
+    def load_cached_metadata(self, filename):
+        '''Set attributes from metadata cached for filename, if available
+
+        Returns True if cached metadata was found, otherwise False.
+        '''
+        if self.cache_dir is None:
+            return False
+        metadata = metadatacache.load_metadata(
+            filename, self.__class__.__name__, self.cache_dir)
+        if metadata is None:
+            return False
+        for attribute, value in metadata.iteritems():
+            setattr(self, attribute, value)
+        return True
+
+    def store_cached_metadata(self, filename, attributes):
+        '''Store given attributes in cache, for next opening of filename'''
+        if self.cache_dir is None:
+            return
+        metadata = {attribute: getattr(self, attribute)
+                    for attribute in attributes if hasattr(self, attribute)}
+        metadatacache.store_metadata(filename, self.__class__.__name__,
+                                     self.cache_dir, metadata)
+
+    def data_source(self):
+        '''Identifier of the data read by this reader
+
+        For readers of a file, this includes the modification time and
+        size of the file, so that blocks of a rewritten file are not
+        reused. Other readers are identified by the reader instance, and
+        should override this method to share blocks between instances
+        with the same parameters.
+        '''
+        filename = getattr(self, 'filename', None)
+        if filename is None:
+            return (self.__class__.__name__, self.instance_number)
+        return (self.__class__.__name__, filename,
+                metadatacache.file_key(filename), self.name, self.proj4)
+
     def pixel_size(self):
         # Find typical pixel size (e.g. for calculating size of buffer)
         if self.projected is True:
@@ -257,7 +393,8 @@ class BaseReader(object):
             x = np.append(x, [x[-1], x[-1]])
             y = np.append(y, [y[-1], y[-1]])
             z = np.append(z, [profiles_depth[0], profiles_depth[1]])
-        env = self.get_variables(variables, time, x, y, z, block)
+        with self.get_variables_lock:
+            env = self.get_variables(variables, time, x, y, z, block)
 
         # Convert any numpy arrays to masked arrays
         for var in env.keys():
@@ -271,6 +408,83 @@ class BaseReader(object):
 
         return env
 
+    def _get_block(self, variables, profiles, profiles_depth, time,
+                   reader_x, reader_y, z):
+        """Return ReaderBlock for given time, from cache, prefetched or read"""
+        cache_key = str((variables, profiles, profiles_depth))
+        if self.block_cache is blockcache.shared_block_cache:
+            cache_key = str((self.data_source(), self.interpolation)) + \
+                cache_key
+        block = self.block_cache.get(cache_key, time, reader_x, reader_y, z)
+        if block is not None:
+            logging.debug('Using cached block for %s' % time)
+            return block
+        if str(variables) in self.var_block_prefetch:
+            prefetch_time, thread, result = \
+                self.var_block_prefetch.pop(str(variables))
+            if prefetch_time == time:
+                thread.join()  # Wait for background reading to finish
+                if 'block' in result and result['block'].covers_positions(
+                        reader_x, reader_y) is True:
+                    logging.debug('Using prefetched block for %s' % time)
+                    block = result['block']
+                else:
+                    logging.debug('Prefetched block for %s can not be '
+                                  'used, reading again' % time)
+        if block is None:
+            reader_data_dict = self._get_variables(variables, profiles,
+                                                   profiles_depth, time,
+                                                   reader_x, reader_y, z,
+                                                   block=True)
+            block = ReaderBlock(reader_data_dict,
+                                interpolation_horizontal=self.interpolation,
+                                land_fill_cache=self.land_fill_cache)
+        self.block_cache.put(cache_key, time, block)
+        return block
+
+    def _prefetch_next_block(self, variables, profiles, profiles_depth,
+                             time, time_before, time_after,
+                             reader_x, reader_y, z):
+        """Start reading the block following the present in background.
+
+        The block is read for the present element positions, and is
+        used by _get_block if it covers the element positions when needed.
+        """
+        previous_time = self.var_block_prefetch_time.get(str(variables))
+        self.var_block_prefetch_time[str(variables)] = time
+        forward = previous_time is None or time >= previous_time
+        if forward is True:
+            next_time = self.time_following(time_after or time_before)
+        else:
+            next_time = self.time_following(time_before, forward=False)
+        if next_time is None:
+            return  # End of reader time coverage
+        if str(variables) in self.var_block_prefetch and \
+                self.var_block_prefetch[str(variables)][0] == next_time:
+            return  # Already being read
+
+        result = {}
+
+        def read_block():
+            try:
+                result['block'] = ReaderBlock(
+                    self._get_variables(variables, profiles,
+                                        profiles_depth, next_time,
+                                        reader_x, reader_y, z,
+                                        block=True),
+                    interpolation_horizontal=self.interpolation,
+                    land_fill_cache=self.land_fill_cache)
+            except Exception as e:
+                logging.debug('Prefetching from %s failed: %s' %
+                              (self.name, e))
+
+        logging.debug('Prefetching block for %s from %s' %
+                      (next_time, self.name))
+        thread = threading.Thread(target=read_block)
+        thread.daemon = True
+        thread.start()
+        self.var_block_prefetch[str(variables)] = (next_time, thread, result)
+
     def get_variables_interpolated(self, variables, profiles=None,
                                    profiles_depth=None, time=None,
                                    lon=None, lat=None, z=None,
@@ -357,14 +571,9 @@ class BaseReader(object):
                 #fi = getframeinfo(currentframe())
                 #print("++++", fi.filename, fi.lineno, "BLOCK", block)
                 # JRH netcdf ex goes in here
-                reader_data_dict = \
-                    self._get_variables(variables, profiles,
-                                        profiles_depth, time_before,
-                                        reader_x, reader_y, z,
-                                        block=block)
                 self.var_block_before[str(variables)] = \
-                    ReaderBlock(reader_data_dict,
-                                interpolation_horizontal=self.interpolation)
+                    self._get_block(variables, profiles, profiles_depth,
+                                    time_before, reader_x, reader_y, z)
                 try:
                     len_z = len(self.var_block_before[str(variables)].z)
                 except:
@@ -381,15 +590,9 @@ class BaseReader(object):
                     self.var_block_after[str(variables)] = \
                         self.var_block_before[str(variables)]
                 else:
-                    reader_data_dict = \
-                        self._get_variables(variables, profiles,
-                                            profiles_depth, time_after,
-                                            reader_x, reader_y, z,
-                                            block=block)
                     self.var_block_after[str(variables)] = \
-                        ReaderBlock(
-                            reader_data_dict,
-                            interpolation_horizontal=self.interpolation)
+                        self._get_block(variables, profiles, profiles_depth,
+                                        time_after, reader_x, reader_y, z)
                     try:
                         len_z = len(self.var_block_after[str(variables)].z)
                     except:
@@ -413,6 +616,12 @@ class BaseReader(object):
                                 'Buffer size (%s) must be increased.' %
                                 (self.name, str(self.buffer)))
 
+            if self.prefetch is True:
+                self._prefetch_next_block(variables, profiles,
+                                          profiles_depth, time,
+                                          time_before, time_after,
+                                          reader_x, reader_y, z)
+
             ############################################################
             # Interpolate before/after blocks onto particles in space
             ############################################################
@@ -429,6 +638,9 @@ class BaseReader(object):
                 logging.debug('Interpolating after (%s) in space  (%s)' %
                               (self.var_block_after[str(variables)].time,
                                self.interpolation))
+                # Same positions, thus same interpolation weights
+                self.var_block_after[str(variables)].share_interpolators(
+                    self.var_block_before[str(variables)])
                 env_after, env_profiles_after = self.var_block_after[
                     str(variables)].interpolate(
                         reader_x, reader_y, z, variables,
@@ -449,6 +661,14 @@ class BaseReader(object):
                            weight_after))
             env = {}
             for var in variables:
+                if self.fast_time_interpolation is True:
+                    env[var] = nan_filled(env_before[var])
+                    env[var] *= 1 - weight_after
+                    after = nan_filled(env_after[var])
+                    after *= weight_after
+                    env[var] += after
+                    replace_invalid_values(var, env[var])
+                    continue
                 # Weighting together, and masking invalid entries
                 env[var] = np.ma.masked_invalid((env_before[var] *
                                                 (1 - weight_after) +
@@ -487,6 +707,11 @@ class BaseReader(object):
             logging.debug('No time interpolation needed - right on time.')
 
             env = env_before
+            if self.fast_time_interpolation is True:
+                env = dict(env_before)
+                for var in variables:
+                    env[var] = nan_filled(env_before[var])
+                    replace_invalid_values(var, env[var])
             if profiles is not None:
                 if 'env_profiles_before' in locals():
                     env_profiles = env_profiles_before
@@ -541,9 +766,15 @@ class BaseReader(object):
             logging.debug('Masking %i elements outside coverage' %
                           (len(lon)-len(ind_covered)))
             for var in variables:
-                tmp = np.nan*np.ones(lon.shape)
-                tmp[ind_covered] = env[var].copy()
-                env[var] = np.ma.masked_invalid(tmp)
+                if self.fast_time_interpolation is True:
+                    tmp = np.empty(lon.shape, dtype=np.float32)
+                    tmp.fill(np.nan)
+                    tmp[ind_covered] = env[var]
+                    env[var] = tmp
+                else:
+                    tmp = np.nan*np.ones(lon.shape)
+                    tmp[ind_covered] = env[var].copy()
+                    env[var] = np.ma.masked_invalid(tmp)
                 # Filling also fin missing columns
                 # for env_profiles outside coverage
                 if env_profiles is not None and var in env_profiles.keys():
@@ -559,6 +790,29 @@ class BaseReader(object):
                        proj_from, proj_to):
         """Rotate vectors from one srs to another."""
 
+        if type(proj_to) is str:
+            proj_to = pyproj.Proj(proj_to)
+
+        rotation_field = None
+        if proj_from is self.proj:
+            rotation_field = self.rotation_field(proj_to)
+        if rotation_field is not None:
+            cos_angle, sin_angle = rotation_field(reader_x, reader_y)
+        else:
+            rot_angle_vectors_rad = self.rotation_angles(
+                reader_x, reader_y, proj_from, proj_to)
+            cos_angle = np.cos(rot_angle_vectors_rad)
+            sin_angle = np.sin(rot_angle_vectors_rad)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            angles = np.degrees(np.arctan2(sin_angle, cos_angle))
+            logging.debug('Rotating vectors between %s and %s degrees.' %
+                          (angles.min(), angles.max()))
+
+        return rotate(u_component, v_component, cos_angle, sin_angle)
+
+    def rotation_angles(self, reader_x, reader_y, proj_from, proj_to):
+        """Angle (radians) of y-axis of proj_from relative to proj_to."""
+
         if type(proj_from) is str:
             proj_from = pyproj.Proj(proj_from)
         if type(proj_from) is not pyproj.Proj:
@@ -583,16 +837,36 @@ class BaseReader(object):
                 geod.inv(x2, y2, x2_delta, y2_delta)[0])
         else:
             rot_angle_vectors_rad = np.arctan2(x2_delta - x2, y2_delta - y2)
-        logging.debug('Rotating vectors between %s and %s degrees.' %
-                      (np.degrees(rot_angle_vectors_rad).min(),
-                       np.degrees(rot_angle_vectors_rad).max()))
-        rot_angle_rad = - rot_angle_vectors_rad
-        u_rot = (u_component*np.cos(rot_angle_rad) -
-                 v_component*np.sin(rot_angle_rad))
-        v_rot = (u_component*np.sin(rot_angle_rad) +
-                 v_component*np.cos(rot_angle_rad))
 
-        return u_rot, v_rot
+        return rot_angle_vectors_rad
+
+    def rotation_field(self, proj_to):
+        """Return cached RotationAngleField from own SRS to proj_to.
+
+        The field covers the domain of the reader, with grid spacing as
+        the reader (at most rotation_grid_nodes along each axis).
+        Returns None if caching is disabled, or domain is not known.
+        """
+        if self.rotation_grid_nodes <= 0:
+            return None
+        key = proj_to.srs
+        if key not in self.rotation_fields:
+            try:
+                nx = int(round((self.xmax - self.xmin)/self.delta_x)) + 1
+                ny = int(round((self.ymax - self.ymin)/self.delta_y)) + 1
+            except (AttributeError, TypeError, ZeroDivisionError):
+                self.rotation_fields[key] = None
+                return None
+            proj_from = self.proj
+
+            def angle_function(x, y):
+                return self.rotation_angles(x, y, proj_from, proj_to)
+
+            self.rotation_fields[key] = RotationAngleField(
+                angle_function, self.xmin, self.xmax, self.ymin, self.ymax,
+                min(nx, self.rotation_grid_nodes),
+                min(ny, self.rotation_grid_nodes))
+        return self.rotation_fields[key]
 
     def xy2lonlat(self, x, y):
         """Calculate x,y in own projection from given lon,lat (scalars/arrays).
@@ -637,9 +911,7 @@ class BaseReader(object):
                 else:
                     return x, y
         else:
-            x = self.spl_x(lon, lat)
-            y = self.spl_y(lon, lat)
-            return (x, y)
+            return self.grid.lonlat2xy(lon, lat)
 
     def y_azimuth(self, lon, lat):
         """Calculate azimuth orientation of the y-axis of the reader SRS."""
@@ -895,6 +1167,33 @@ class BaseReader(object):
         return nearest_time, time_before, time_after,\
             indx_nearest, indx_before, indx_after
 
+    def time_following(self, time, forward=True):
+        """Return the reader time following (or preceding) given time.
+
+        Returns None if there is no such time within coverage of reader.
+        """
+        if self.start_time is None or self.start_time == self.end_time:
+            return None
+        if hasattr(self, 'times') and self.times is not None:
+            if forward is True:
+                indx = bisect_right(self.times, time)
+            else:
+                indx = bisect_left(self.times, time) - 1
+            if indx < 0 or indx >= len(self.times):
+                return None
+            return self.times[indx]
+        if forward is True:
+            following = self.start_time + self.time_step*int(np.floor(
+                (time - self.start_time).total_seconds() /
+                self.time_step.total_seconds()) + 1)
+        else:
+            following = self.start_time + self.time_step*int(np.ceil(
+                (time - self.start_time).total_seconds() /
+                self.time_step.total_seconds()) - 1)
+        if following < self.start_time or following > self.end_time:
+            return None
+        return following
+
     def index_of_closest_z(self, requested_z):
         """Return (internal) index of z closest to requested z.
 
@@ -0,0 +1,121 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def block_size(block):
+    """Return approximate memory size (bytes) of a ReaderBlock."""
+    size = 0
+    for data in block.data_dict.values() + [block.x, block.y, block.z]:
+        if isinstance(data, np.ndarray):
+            size += data.nbytes
+            mask = np.ma.getmask(data)
+            if mask is not np.ma.nomask:
+                size += mask.nbytes
+    return size
+
+
+class ReaderBlockCache(object):
+    """Least recently used cache of ReaderBlocks, bounded by memory size.
+
+    Blocks are stored by variables (string), time and spatial window
+    (x and y extent of block). A stored block is returned for requests
+    of the same variables and time, if it covers the requested positions.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes  # 0 means that caching is disabled
+        self.blocks = OrderedDict()  # Least recently used first
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, variables, time, x, y, z=None):
+        """Return cached block covering given positions, or None."""
+        if self.max_bytes <= 0:
+            return None
+        with self.lock:
+            for key in self.blocks.keys()[::-1]:
+                if key[0] != variables or key[1] != time:
+                    continue
+                block, size = self.blocks[key]
+                if block.covers_positions(x, y) is False:
+                    continue
+                if z is not None and block.z is not None and \
+                        len(np.atleast_1d(block.z)) > 1 and (
+                        np.min(z) < np.min(block.z) or
+                        np.max(z) > np.max(block.z)):
+                    continue
+                self.blocks[key] = self.blocks.pop(key)  # Most recent
+                self.hits += 1
+                return block
+            self.misses += 1
+            return None
+
+    def put(self, variables, time, block):
+        """Store block, evicting least recently used blocks if needed."""
+        if self.max_bytes <= 0:
+            return
+        size = block_size(block)
+        if size > self.max_bytes:
+            logging.debug('Block of %i bytes is larger than cache size '
+                          '(%i bytes), not stored' % (size, self.max_bytes))
+            return
+        key = (variables, time, block.x.min(), block.x.max(),
+               block.y.min(), block.y.max())
+        with self.lock:
+            if key in self.blocks:
+                self.num_bytes -= self.blocks.pop(key)[1]
+            while self.num_bytes + size > self.max_bytes:
+                evicted_key, (evicted, evicted_size) = \
+                    self.blocks.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+                logging.debug('Evicted block %s from cache' %
+                              str(evicted_key[0:2]))
+            self.blocks[key] = (block, size)
+            self.num_bytes += size
+
+    def clear(self):
+        """Remove all blocks from cache."""
+        with self.lock:
+            self.blocks = OrderedDict()
+            self.num_bytes = 0
+
+    def __repr__(self):
+        return ('ReaderBlockCache: %i blocks, %.1f of %.1f MB, '
+                '%i hits, %i misses, %i evictions' %
+                (len(self.blocks), self.num_bytes/1e6, self.max_bytes/1e6,
+                 self.hits, self.misses, self.evictions))
+
+
+# Process-wide cache, which may be shared by readers of the same data
+# source, e.g. in several simulations run one after the other
+shared_block_cache = ReaderBlockCache()
+
+
+def set_shared_block_cache_size(max_bytes):
+    """Set maximum memory size (bytes) of the process-wide cache."""
+    shared_block_cache.max_bytes = max_bytes
+    if max_bytes <= 0:
+        shared_block_cache.clear()
@@ -0,0 +1,166 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import os
+import logging
+import hashlib
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from metadatacache import read_pickle, write_pickle
+
+
+def _lonlat_to_xyz(lon, lat):
+    """Cartesian coordinates on unit sphere."""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    return np.column_stack((np.cos(lat)*np.cos(lon),
+                            np.cos(lat)*np.sin(lon),
+                            np.sin(lat)))
+
+
+class CurvilinearGrid(object):
+    """Inverse mapping (lon, lat) -> (x, y) for grids without projection.
+
+    x and y are the (fractional) column and row indices of the lon and lat
+    arrays, plus xmin and ymin. The nearest grid node is found with a
+    KD-tree, and the bilinear mapping of the grid (as used by
+    map_coordinates in xy2lonlat) is then inverted with Newton iterations.
+    Positions outside the grid are returned as NaN.
+    """
+
+    iterations = 8
+
+    def __init__(self, lon, lat, xmin=0, ymin=0):
+        self.lon = np.asarray(np.ma.filled(lon, np.nan), dtype=np.float64)
+        self.lat = np.asarray(np.ma.filled(lat, np.nan), dtype=np.float64)
+        self.xmin = xmin
+        self.ymin = ymin
+        self.ny, self.nx = self.lon.shape
+        valid = np.where(np.isfinite(self.lon.ravel()) &
+                         np.isfinite(self.lat.ravel()))[0]
+        self.valid_nodes = valid
+        self.tree = cKDTree(_lonlat_to_xyz(self.lon.ravel()[valid],
+                                           self.lat.ravel()[valid]))
+        # Chord distance to farthest neighbour node, to detect positions
+        # far outside the grid
+        dist, ind = self.tree.query(self.tree.data, k=2)
+        self.max_node_distance = 2*dist[:, 1].max()
+
+    def lonlat2xy(self, lon, lat):
+        """Return x, y (arrays) for given lon, lat (scalars/arrays)."""
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64)).ravel()
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64)).ravel()
+        x = np.nan*np.ones(lon.shape)
+        y = np.nan*np.ones(lon.shape)
+        finite = np.where(np.isfinite(lon) & np.isfinite(lat))[0]
+        if len(finite) == 0:
+            return x, y
+        lon = lon[finite]
+        lat = lat[finite]
+
+        dist, ind = self.tree.query(_lonlat_to_xyz(lon, lat))
+        node = self.valid_nodes[ind]
+        i = (node % self.nx).astype(np.float64)  # Column
+        j = (node // self.nx).astype(np.float64)  # Row
+        coslat = np.cos(np.radians(lat))
+
+        fu = np.nan*np.ones(lon.shape)
+        fv = np.nan*np.ones(lon.shape)
+        for it in range(self.iterations):
+            # Positions with non-finite estimates, e.g. from cells with
+            # NaN corner nodes, are kept as NaN, i.e. outside grid
+            active = np.where(np.isfinite(i) & np.isfinite(j))[0]
+            if len(active) == 0:
+                break
+            ia = i[active]
+            ja = j[active]
+            lona = lon[active]
+            lata = lat[active]
+            i0 = np.clip(np.floor(ia), 0, self.nx - 2).astype(int)
+            j0 = np.clip(np.floor(ja), 0, self.ny - 2).astype(int)
+            a = ia - i0
+            b = ja - j0
+            # Corner coordinates relative to target position [degrees]
+            corners = []
+            for dj, di in ((0, 0), (0, 1), (1, 0), (1, 1)):
+                clon = self.lon[j0 + dj, i0 + di]
+                clat = self.lat[j0 + dj, i0 + di]
+                corners.append(((np.mod(clon - lona + 180, 360) - 180)*
+                                coslat[active], clat - lata))
+            (u00, v00), (u10, v10), (u01, v01), (u11, v11) = corners
+            fua = (u00*(1 - a)*(1 - b) + u10*a*(1 - b) +
+                   u01*(1 - a)*b + u11*a*b)
+            fva = (v00*(1 - a)*(1 - b) + v10*a*(1 - b) +
+                   v01*(1 - a)*b + v11*a*b)
+            dua = (u10 - u00)*(1 - b) + (u11 - u01)*b
+            dub = (u01 - u00)*(1 - a) + (u11 - u10)*a
+            dva = (v10 - v00)*(1 - b) + (v11 - v01)*b
+            dvb = (v01 - v00)*(1 - a) + (v11 - v10)*a
+            det = dua*dvb - dub*dva
+            det[det == 0] = np.nan
+            fu[active] = fua
+            fv[active] = fva
+            i[active] = ia - (fua*dvb - fva*dub)/det
+            j[active] = ja - (fva*dua - fua*dva)/det
+
+        # Mask positions outside grid
+        tolerance = 1e-6
+        with np.errstate(invalid='ignore'):
+            outside = ((i < -tolerance) | (i > self.nx - 1 + tolerance) |
+                       (j < -tolerance) | (j > self.ny - 1 + tolerance) |
+                       (dist > self.max_node_distance) |
+                       (np.abs(fu) > 1e-5) | (np.abs(fv) > 1e-5))
+        i[outside] = np.nan
+        j[outside] = np.nan
+        x[finite] = np.clip(i, 0, self.nx - 1) + self.xmin
+        y[finite] = np.clip(j, 0, self.ny - 1) + self.ymin
+        return x, y
+
+
+_grids = {}  # Grids of this process, by checksum of lon and lat
+_grids_lock = threading.Lock()
+
+
+def get_curvilinear_grid(lon, lat, xmin=0, ymin=0, cache_dir=None):
+    """Return CurvilinearGrid, reusing any grid made before.
+
+    Grids are kept in memory for this process, and if cache_dir is given,
+    also stored on disk for later use by other processes.
+    """
+    lon = np.ma.filled(lon, np.nan)
+    lat = np.ma.filled(lat, np.nan)
+    checksum = hashlib.sha1()
+    for arr in (lon, lat):
+        checksum.update(str(arr.shape))
+        checksum.update(np.ascontiguousarray(arr, dtype=np.float64).data)
+    key = '%s_%s_%s' % (checksum.hexdigest(), xmin, ymin)
+    with _grids_lock:
+        if key in _grids:
+            return _grids[key]
+        grid = None
+        if cache_dir is not None:
+            filename = os.path.join(cache_dir, 'curvilinear_%s.pickle' % key)
+            grid = read_pickle(filename)
+        if grid is None:
+            logging.info('Making lookup tree for lon,lat to x,y conversion')
+            grid = CurvilinearGrid(lon, lat, xmin, ymin)
+            if cache_dir is not None:
+                write_pickle(filename, grid)
+        _grids[key] = grid
+        return grid
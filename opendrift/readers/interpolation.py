@@ -1,14 +1,26 @@
 import logging
+import threading
 
 import numpy as np
 from scipy.ndimage import map_coordinates
-import scipy.ndimage as ndimage
 from scipy.interpolate import interp1d, LinearNDInterpolator
 
+from landfill import land_fill, land_fill_indices
+
 
 ###########################
 # 2D interpolator classes
 ###########################
+# Interpolators are called with 2D arrays (y, x), or 3D arrays
+# (layers, y, x), in which case all layers are interpolated at once.
+
+def _coordinates(array, yi, xi):
+    """Coordinates for map_coordinates, for all layers of array."""
+    if array.ndim == 2:
+        return [yi, xi]
+    layers = np.arange(array.shape[0])[:, np.newaxis]*np.ones(len(xi))
+    return [layers, yi*np.ones(layers.shape), xi*np.ones(layers.shape)]
+
 
 class Nearest2DInterpolator():
 
@@ -22,8 +34,8 @@ class Nearest2DInterpolator():
         self.xi[self.xi >= len(xgrid)] = len(xgrid)-1
         self.yi[self.yi >= len(ygrid)] = len(ygrid)-1
 
-    def __call__(self, array2d):
-        return array2d[self.yi, self.xi]
+    def __call__(self, array):
+        return array[..., self.yi, self.xi]
 
 
 class NDImage2DInterpolator():
@@ -34,14 +46,14 @@ class NDImage2DInterpolator():
         self.xi = (x - xgrid.min())/(xgrid.max()-xgrid.min())*len(xgrid)
         self.yi = (y - ygrid.min())/(ygrid.max()-ygrid.min())*len(ygrid)
 
-    def __call__(self, array2d):
+    def __call__(self, array):
         try:
-            array2d = np.ma.array(array2d, mask=array2d.mask)
-            array2d[array2d.mask] = np.nan  # Gives holes
+            array = np.ma.array(array, mask=array.mask)
+            array[array.mask] = np.nan  # Gives holes
         except:
             pass
         return np.ma.masked_invalid(
-            map_coordinates(array2d, [self.yi, self.xi],
+            map_coordinates(array, _coordinates(array, self.yi, self.xi),
                             cval=np.nan, order=0))
 
 
@@ -55,6 +67,8 @@ class LinearND2DInterpolator():
         self.y = y
 
     def __call__(self, array2d):
+        if array2d.ndim == 3:
+            return np.ma.array([self(layer) for layer in array2d])
         valid = ~np.ravel(array2d).mask
 
         if hasattr(self, 'interpolator'):
@@ -78,46 +92,109 @@ class LinearND2DInterpolator():
         return self.interpolator(self.y, self.x)
         
         
+class Bilinear2DInterpolator():
+    """Bilinear interpolation on rectilinear grid, disregarding masked nodes.
+
+    Cell indices and weights are calculated once for the given positions,
+    and reused for all arrays (variables and layers) on the same grid.
+    Masked (or NaN) nodes are disregarded, and the weights of the remaining
+    nodes of the cell are renormalised, so that elements near land get
+    values from the nearby ocean nodes. Values are masked for positions
+    outside the grid, or within cells without any valid nodes.
+    Arrays may have any number of leading dimensions (e.g. layers).
+    """
+
+    def __init__(self, xgrid, ygrid, x, y):
+        self.x = x
+        self.y = y
+        self.nx = len(xgrid)
+        i, wx, outside_x = self._cell_indices(xgrid, x)
+        j, wy, outside_y = self._cell_indices(ygrid, y)
+        self.outside = outside_x | outside_y
+        i1 = np.minimum(i + 1, len(xgrid) - 1)
+        j1 = np.minimum(j + 1, len(ygrid) - 1)
+        # Flat indices and weights of the four corners of the cells
+        self.indices = np.array([j*self.nx + i, j*self.nx + i1,
+                                 j1*self.nx + i, j1*self.nx + i1])
+        self.weights = np.array([(1 - wx)*(1 - wy), wx*(1 - wy),
+                                 (1 - wx)*wy, wx*wy])
+
+    @staticmethod
+    def _cell_indices(grid, coord):
+        """Index of lower node of cell, and weight of upper node."""
+        grid = np.asarray(grid, dtype=np.float64)
+        coord = np.asarray(coord, dtype=np.float64)
+        if len(grid) > 1 and grid[-1] < grid[0]:  # Decreasing
+            grid = -grid
+            coord = -coord
+        outside = ~((coord >= grid[0]) & (coord <= grid[-1]))
+        if len(grid) == 1:
+            return (np.zeros(coord.shape, dtype=np.int),
+                    np.zeros(coord.shape), outside)
+        index = np.searchsorted(grid, coord, side='right') - 1
+        index = np.clip(index, 0, len(grid) - 2)
+        weight = (coord - grid[index])/(grid[index + 1] - grid[index])
+        weight[outside] = 0
+        return index, weight, outside
+
+    def __call__(self, array):
+        shape = array.shape[:-2] + (-1,)
+        values = np.ma.getdata(array).reshape(shape)[..., self.indices]
+        valid = np.isfinite(values)
+        mask = np.ma.getmask(array)
+        if mask is not np.ma.nomask:
+            valid &= ~mask.reshape(shape)[..., self.indices]
+        weights = np.where(valid, self.weights, 0)
+        total = weights.sum(axis=-2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = (np.where(valid, values, 0)*weights).sum(axis=-2)/total
+        result[..., self.outside] = np.nan
+        return np.ma.masked_invalid(result, copy=False)
+
+
 class Linear2DInterpolator():
+    """Linear interpolation with map_coordinates.
+
+    Masked data (i.e. land with no flow) must first be filled by five
+    grid cells with prepare(), which ReaderBlock does once for each
+    variable of the block, with the nearest valid value.
+    """
 
     def __init__(self, xgrid, ygrid, x, y):
         self.x = x
         self.y = y
         self.xi = (x - xgrid.min())/(xgrid.max()-xgrid.min())*len(xgrid)
         self.yi = (y - ygrid.min())/(ygrid.max()-ygrid.min())*len(ygrid)
-        self.valid_arrays = []
-        
-    # "Grows" the unmasked areas by one pixel
+
     @staticmethod
-    def expandData(in_data):
-        out_mask = ~ndimage.morphology.binary_dilation(~in_data.mask.copy())
-        out_data = in_data.filled(np.finfo(np.float64).min)
-        out_data = ndimage.morphology.grey_dilation(out_data, size=3)
-        out_data[~in_data.mask] = in_data.data[~in_data.mask]
-        out = np.ma.masked_array(out_data, mask=out_mask)
-        return out
+    def prepare(array, land_fill_cache=None):
+        """Return array with masked data filled from nearest valid cell.
+
+        Masked cells up to five cells from valid data are filled. The index
+        map of the fill is taken from land_fill_cache, if given.
+        """
+        if not isinstance(array, np.ma.MaskedArray):
+            logging.debug('Array used for interpolation is not a '
+                          'masked array.')
+            return array
+        mask = np.ma.getmaskarray(array)
+        if not mask.any():
+            return array
+        if land_fill_cache is None:
+            indices, unreached = land_fill_indices(mask)
+        else:
+            indices, unreached = land_fill_cache.get(mask)
+        return land_fill(array, indices, unreached)
 
-    def __call__(self, array2d):
-        if not isinstance(array2d,np.ma.MaskedArray):
-            logging.debug('Array used for interpolation is not a masked array.')
-    
-        array2d_ptr, read_only = array2d.data.__array_interface__['data'] 
-    
-        # change the array2d to fill masked parts 
-        # i.e., land with no flow
-        if array2d_ptr not in self.valid_arrays:
-            # Fill five cells of masked data
-            for i in range(5):
-                array2d = self.expandData(array2d)
-            self.valid_arrays.append(array2d_ptr)
-        
-        return map_coordinates(array2d, [self.yi, self.xi],
-                                cval=np.nan, order=1)
+    def __call__(self, array):
+        return map_coordinates(array, _coordinates(array, self.yi, self.xi),
+                               cval=np.nan, order=1)
 
 horizontal_interpolation_methods = {
     'nearest': Nearest2DInterpolator,
     'ndimage': NDImage2DInterpolator,
-    'linearND': LinearND2DInterpolator,
+    'linearND': Bilinear2DInterpolator,
+    'delaunay': LinearND2DInterpolator,
     'linearNDFast': Linear2DInterpolator}
 
 
@@ -180,11 +257,18 @@ vertical_interpolation_methods = {
 ###########################
 
 class ReaderBlock():
-    """Class to store and interpolate the output from a reader."""
+    """Class to store and interpolate the output from a reader.
+
+    Interpolators (indices and weights) are calculated once for given
+    element positions, and applied to all variables and layers. They are
+    reused for the next call with the same positions, and may be shared
+    with another block on the same grid (share_interpolators), e.g. for
+    the block of the following time.
+    """
 
     def __init__(self, data_dict,
                  interpolation_horizontal='ndimage',
-                 interpolation_vertical='linear'):
+                 interpolation_vertical='linear', land_fill_cache=None):
 
         # Make pointers to data values, for convenience
         self.x = data_dict['x']
@@ -199,6 +283,7 @@ class ReaderBlock():
             del self.data_dict['z']
         except:
             self.z = None
+        self.lock = threading.Lock()
 
         # Mask any extremely large values, e.g. if missing netCDF _Fill_value
         for var in self.data_dict:
@@ -223,15 +308,57 @@ class ReaderBlock():
                 'Valid interpolation methods are: ' +
                 str(vertical_interpolation_methods.keys()))
 
+        # Preparation of data for interpolator, done once per block
+        if hasattr(self.Interpolator2DClass, 'prepare'):
+            for var in self.data_dict:
+                self.data_dict[var] = self.Interpolator2DClass.prepare(
+                    self.data_dict[var], land_fill_cache)
+
+        # Element positions (x, y, z) and corresponding interpolators
+        self.interpolators = None
+
     def _initialize_interpolator(self, x, y, z=None):
+        if self.interpolators is not None:
+            positions, interpolator2d, interpolator1d = self.interpolators
+            if all([np.array_equal(p, q) for p, q in
+                    zip(positions, (x, y, z))]):
+                logging.debug('Reusing interpolator.')
+                self.interpolator2d = interpolator2d
+                self.interpolator1d = interpolator1d
+                return
         logging.debug('Initialising interpolator.')
         self.interpolator2d = self.Interpolator2DClass(self.x, self.y, x, y)
         if self.z is not None and len(np.atleast_1d(self.z)) > 1:
             self.interpolator1d = self.Interpolator1DClass(self.z, z)
+        else:
+            self.interpolator1d = None
+        self.interpolators = ((x, y, z), self.interpolator2d,
+                              self.interpolator1d)
+
+    def share_interpolators(self, other):
+        """Reuse interpolators of other block, if on the same grid."""
+        if other is self or other.interpolators is None or \
+                other.Interpolator2DClass is not self.Interpolator2DClass or \
+                other.Interpolator1DClass is not self.Interpolator1DClass:
+            return
+        if not (np.array_equal(self.x, other.x) and
+                np.array_equal(self.y, other.y) and
+                np.array_equal(self.z, other.z)):
+            return
+        with self.lock:
+            self.interpolators = other.interpolators
 
     def interpolate(self, x, y, z=None, variables=None,
                     profiles=[], profiles_depth=None):
 
+        # Blocks may be shared between readers (see blockcache)
+        with self.lock:
+            return self._interpolate(x, y, z, variables,
+                                     profiles, profiles_depth)
+
+    def _interpolate(self, x, y, z=None, variables=None,
+                     profiles=[], profiles_depth=None):
+
         self._initialize_interpolator(x, y, z)
 
         env_dict = {}
@@ -253,12 +380,8 @@ class ReaderBlock():
         if data.ndim == 2:
             return self.interpolator2d(data)
         if data.ndim == 3:
-            num_layers = data.shape[0]
-            # Allocate output array
-            result = np.ma.empty((num_layers, len(self.interpolator2d.x)))
-            for layer in range(num_layers):
-                result[layer, :] = self.interpolator2d(data[layer, :, :])
-            return result
+            # All layers at once, with the same indices and weights
+            return np.ma.asarray(self.interpolator2d(data))
 
     def covers_positions(self, x, y, z=None):
         '''Check if given positions are covered by this reader block.'''
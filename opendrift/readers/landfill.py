@@ -0,0 +1,97 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import ndimage
+
+
+def land_fill_indices(mask, cells=5):
+    """Return index map to fill masked cells from nearest valid cell.
+
+    For masked cells within the given number of cells (taxicab distance
+    along the last two, horizontal, axes) from a valid cell of the same
+    layer, the flat index of the nearest valid cell is given. Other cells
+    map to themselves. Also returned is the mask of cells not reached.
+    """
+    mask = np.asarray(mask, dtype=np.bool)
+    shape = mask.shape
+    layers = mask.reshape((-1,) + shape[-2:])
+    layer_size = shape[-2]*shape[-1]
+    indices = np.arange(mask.size).reshape(layers.shape)
+    unreached = layers.copy()
+    for k, layer in enumerate(layers):
+        if not layer.any() or layer.all():
+            continue  # Nothing to fill, or no values to fill with
+        distance, (j, i) = ndimage.distance_transform_cdt(
+            layer, metric='taxicab', return_indices=True)
+        reached = distance <= cells
+        indices[k][reached] = \
+            k*layer_size + j[reached]*shape[-1] + i[reached]
+        unreached[k] = ~reached
+    return indices.reshape(shape), unreached.reshape(shape)
+
+
+def land_fill(array, indices, unreached):
+    """Return masked array filled with index map from land_fill_indices.
+
+    Cells not reached by the fill remain masked, with value NaN.
+    """
+    data = np.ma.getdata(array).ravel()[indices]
+    if data.dtype.kind != 'f':
+        data = data.astype(np.float64)
+    data[unreached] = np.nan
+    return np.ma.masked_array(data, mask=unreached)
+
+
+class LandFillCache(object):
+    """Index maps of land fill, by land mask.
+
+    The land mask of a reader grid is static, so the index map calculated
+    for the first block of data may be reused for all variables, layers and
+    times of the following blocks, as long as they cover the same part of
+    the grid. Index maps are stored by the mask itself, for the given
+    maximum number of different masks.
+    """
+
+    def __init__(self, cells=5, max_entries=20):
+        self.cells = cells
+        self.max_entries = max_entries
+        self.index_maps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, mask):
+        """Return indices and mask of unreached cells, for given mask."""
+        mask = np.asarray(mask, dtype=np.bool)
+        key = (mask.shape,
+               hashlib.sha1(np.packbits(mask).tostring()).hexdigest())
+        with self.lock:
+            if key in self.index_maps:
+                index_map = self.index_maps.pop(key)
+                self.index_maps[key] = index_map  # Most recently used
+                return index_map
+        logging.debug('Calculating land fill for mask of shape %s' %
+                      str(mask.shape))
+        index_map = land_fill_indices(mask, self.cells)
+        with self.lock:
+            self.index_maps[key] = index_map
+            while len(self.index_maps) > self.max_entries:
+                self.index_maps.popitem(last=False)
+        return index_map
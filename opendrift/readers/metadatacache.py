@@ -0,0 +1,93 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+"""On-disk cache of reader metadata (coordinates, times, variables...)
+
+Entries are stored as pickle files in a cache folder, named from the
+path, modification time and size of the data file, so that a modified
+file is not matched by an old entry.
+"""
+
+import os
+import logging
+import hashlib
+import cPickle as pickle
+
+
+def file_key(filename):
+    """Return key identifying a file by path, mtime and size, or None."""
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None  # E.g. URL (OPeNDAP) or pattern of several files
+    identifier = '%s_%r_%i' % (os.path.abspath(filename),
+                               stat.st_mtime, stat.st_size)
+    return hashlib.sha1(identifier).hexdigest()
+
+
+def read_pickle(filename):
+    """Return object stored in pickle file, or None if not available."""
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        logging.warning('Could not read cache file %s: %s' % (filename, e))
+        return None
+
+
+def write_pickle(filename, obj):
+    """Store object in pickle file, via temporary file (atomic)."""
+    try:
+        folder = os.path.dirname(filename)
+        if folder != '' and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmpfile = filename + '.%i.tmp' % os.getpid()
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, filename)
+    except Exception as e:
+        logging.warning('Could not write cache file %s: %s' % (filename, e))
+
+
+def _cache_filename(filename, prefix, cache_dir):
+    key = file_key(filename)
+    if key is None:
+        return None
+    return os.path.join(cache_dir, '%s_%s.pickle' % (prefix, key))
+
+
+def load_metadata(filename, prefix, cache_dir):
+    """Return dictionary of metadata cached for filename, or None."""
+    cache_filename = _cache_filename(filename, prefix, cache_dir)
+    if cache_filename is None:
+        return None
+    metadata = read_pickle(cache_filename)
+    if metadata is not None:
+        logging.debug('Read metadata of %s from %s' %
+                      (filename, cache_filename))
+    return metadata
+
+
+def store_metadata(filename, prefix, cache_dir, metadata):
+    """Store dictionary of metadata for filename."""
+    cache_filename = _cache_filename(filename, prefix, cache_dir)
+    if cache_filename is None:
+        return
+    logging.debug('Storing metadata of %s in %s' %
+                  (filename, cache_filename))
+    write_pickle(cache_filename, metadata)
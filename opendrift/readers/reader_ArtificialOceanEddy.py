@@ -55,6 +55,9 @@ class Reader(BaseReader):
         # Run constructor of parent Reader class
         super(Reader, self).__init__()
 
+    def data_source(self):
+        return (self.__class__.__name__, self.proj4, self.x0, self.y0)
+
     def get_variables(self, requestedVariables, time=None,
                       x=None, y=None, z=None, block=False):
 
@@ -64,6 +64,8 @@ class Reader(BaseReader):
             -6500, -7000, -7500, -8000]
 
         filestr = str(filename)
+        self.filename = filestr
+        self.files = filename  # Filename, pattern or list of files
         if name is None:
             self.name = filestr
         else:
@@ -71,13 +73,7 @@ class Reader(BaseReader):
 
         try:
             # Open file, check that everything is ok
-            logging.info('Opening dataset: ' + filestr)
-            if ('*' in filestr) or ('?' in filestr) or ('[' in filestr):
-                logging.info('Opening files with MFDataset')
-                self.Dataset = MFDataset(filename)
-            else:
-                logging.info('Opening file with Dataset')
-                self.Dataset = Dataset(filename, 'r')
+            self.open_dataset()
         except Exception as e:
             raise ValueError(e)
 
@@ -174,6 +170,17 @@ class Reader(BaseReader):
         # Run constructor of parent Reader class
         super(Reader, self).__init__()
 
+    def open_dataset(self):
+        """Open file(s) given by filename (may be pattern or list)"""
+        filestr = self.filename
+        logging.info('Opening dataset: ' + filestr)
+        if ('*' in filestr) or ('?' in filestr) or ('[' in filestr):
+            logging.info('Opening files with MFDataset')
+            self.Dataset = MFDataset(self.files)
+        else:
+            logging.info('Opening file with Dataset')
+            self.Dataset = Dataset(self.files, 'r')
+
     def get_variables(self, requested_variables, time=None,
                       x=None, y=None, z=None, block=False):
 
@@ -43,6 +43,11 @@ class Reader(BaseReader):
         # Run constructor of parent Reader class
         super(Reader, self).__init__()
         
+    def data_source(self):
+        return (self.__class__.__name__,) + tuple(sorted(
+            (var, tuple(value.tolist()))
+            for var, value in self._parameter_value_map.iteritems()))
+
     def get_variables(self, requestedVariables, time=None,
                       x=None, y=None, z=None, block=False):
         
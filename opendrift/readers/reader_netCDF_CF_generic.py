@@ -27,12 +27,21 @@ def convert_longitude_360_to_180(long_array):
 
 class Reader(BaseReader):
 
+    # Attributes stored in cache, if BaseReader.cache_dir is set
+    cached_attributes = ['proj4', 'xname', 'yname', 'unitfactor',
+                         'numx', 'numy', 'z', 'times', 'start_time',
+                         'end_time', 'time_step', 'xmin', 'xmax',
+                         'ymin', 'ymax', 'delta_x', 'delta_y',
+                         'x', 'y', 'variable_mapping']
+
     def __init__(self, filename=None, name=None):
 
         if filename is None:
             raise ValueError('Need filename as argument to constructor')
 
         filestr = str(filename)
+        self.filename = filestr
+        self.files = filename  # Filename, pattern or list of files
         if name is None:
             self.name = filestr
         else:
@@ -40,16 +49,32 @@ class Reader(BaseReader):
 
         try:
             # Open file, check that everything is ok
-            logging.info('Opening dataset: ' + filestr)
-            if ('*' in filestr) or ('?' in filestr) or ('[' in filestr):
-                logging.info('Opening files with MFDataset')
-                self.Dataset = MFDataset(filename)
-            else:
-                logging.info('Opening file with Dataset')
-                self.Dataset = Dataset(filename, 'r')
+            self.open_dataset()
         except Exception as e:
             raise ValueError(e)
 
+        if self.load_cached_metadata(filestr) is False:
+            self.read_metadata()
+            self.store_cached_metadata(filestr, self.cached_attributes)
+
+        self.variables = self.variable_mapping.keys()
+
+        # Run constructor of parent Reader class
+        super(Reader, self).__init__()
+
+    def open_dataset(self):
+        """Open file(s) given by filename (may be pattern or list)"""
+        filestr = self.filename
+        logging.info('Opening dataset: ' + filestr)
+        if ('*' in filestr) or ('?' in filestr) or ('[' in filestr):
+            logging.info('Opening files with MFDataset')
+            self.Dataset = MFDataset(self.files)
+        else:
+            logging.info('Opening file with Dataset')
+            self.Dataset = Dataset(self.files, 'r')
+
+    def read_metadata(self):
+        """Find projection, coordinates, times and variables of Dataset"""
         logging.debug('Finding map projection.')
         # Find projection (variable which as proj4 string)
         for var_name in self.Dataset.variables:
@@ -64,10 +89,11 @@ class Reader(BaseReader):
 
         logging.debug('Finding coordinate variables.')
         # Find x, y and z coordinates
-        print('all variables', self.Dataset.variables.keys())
+        logging.debug('All variables: %s' %
+                      str(self.Dataset.variables.keys()))
         for var_name in self.Dataset.variables:
             var = self.Dataset.variables[var_name]
-            print(var_name)
+            logging.debug('Checking variable %s' % var_name)
             # JRH - some are 2 dim - will need to deal with this
             #if var.ndim > 1:
             #    continue  # Coordinates must be 1D-array
@@ -135,10 +161,8 @@ class Reader(BaseReader):
                     self.time_step = None
 
         if 'x' not in locals():
-            from IPython import embed; embed()
             raise ValueError('Did not find x-coordinate variable')
         if 'y' not in locals():
-            from IPython import embed; embed()
             raise ValueError('Did not find y-coordinate variable')
         self.xmin, self.xmax = x.min(), x.max()
         self.ymin, self.ymax = y.min(), y.max()
@@ -182,13 +206,6 @@ class Reader(BaseReader):
                 standard_name = self.variable_aliases[var_name]
                 self.variable_mapping[standard_name] = str(var_name)
 
-
-
-        self.variables = self.variable_mapping.keys()
-
-        # Run constructor of parent Reader class
-        super(Reader, self).__init__()
-
     def get_variables(self, requested_variables, time=None,
                       x=None, y=None, z=None, block=False,jo_plot=False):
 
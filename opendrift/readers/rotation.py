@@ -0,0 +1,84 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import logging
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+
+def rotate(u_component, v_component, cos_angle, sin_angle):
+    """Return vector components in a frame rotated clockwise by angle."""
+    return (u_component*cos_angle + v_component*sin_angle,
+            -u_component*sin_angle + v_component*cos_angle)
+
+
+class RotationAngleField(object):
+    """Rotation angles between two SRS, precalculated on a regular grid.
+
+    angle_function(x, y) shall return the rotation angle (radians) at
+    positions x, y. It is evaluated once at the nodes of a grid covering
+    the given extent, and the cosine and sine of the angle are thereafter
+    interpolated bilinearly to requested positions. The angle function
+    is evaluated directly for positions outside the grid, or next to
+    nodes where the angle is not defined.
+    """
+
+    def __init__(self, angle_function, xmin, xmax, ymin, ymax,
+                 nx=100, ny=100):
+        self.angle_function = angle_function
+        self.xmin = xmin
+        self.xmax = xmax
+        self.ymin = ymin
+        self.ymax = ymax
+        nx = max(nx, 2)
+        ny = max(ny, 2)
+        self.dx = (xmax - xmin)/float(nx - 1)
+        self.dy = (ymax - ymin)/float(ny - 1)
+        x, y = np.meshgrid(np.linspace(xmin, xmax, nx),
+                           np.linspace(ymin, ymax, ny))
+        logging.debug('Calculating rotation angles on %i x %i grid' %
+                      (nx, ny))
+        angles = np.ma.filled(np.asarray(
+            angle_function(x.ravel(), y.ravel()), dtype=np.float64),
+            np.nan).reshape(x.shape)
+        self.cos = np.cos(angles)
+        self.sin = np.sin(angles)
+
+    def covers(self, x, y):
+        """Return True if all positions are within the grid."""
+        return (np.nanmin(x) >= self.xmin and np.nanmax(x) <= self.xmax and
+                np.nanmin(y) >= self.ymin and np.nanmax(y) <= self.ymax)
+
+    def __call__(self, x, y):
+        """Return cosine and sine of rotation angle at x, y (arrays)."""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        i = (x - self.xmin)/self.dx
+        j = (y - self.ymin)/self.dy
+        cos = map_coordinates(self.cos, [j, i], order=1, cval=np.nan,
+                              mode='constant')
+        sin = map_coordinates(self.sin, [j, i], order=1, cval=np.nan,
+                              mode='constant')
+        norm = np.sqrt(cos*cos + sin*sin)
+        cos = cos/norm
+        sin = sin/norm
+        missing = ~np.isfinite(cos) | ~np.isfinite(sin)
+        if missing.any():
+            angles = self.angle_function(x[missing], y[missing])
+            cos[missing] = np.cos(angles)
+            sin[missing] = np.sin(angles)
+        return cos, sin
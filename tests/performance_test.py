@@ -16,6 +16,7 @@ import platform
 import netCDF4
 from mpl_toolkits import basemap
 from opendrift.models.openoil3D import OpenOil3D
+from opendrift.models.oceandrift3D import OceanDrift3D
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers.interpolation import ReaderBlock
@@ -133,5 +134,108 @@ time_spent = datetime.now() - start_time
 print '%6.1f seconds on this machine' % time_spent.total_seconds()
 
 
+print '--------------------------------------------------------'
+print 'Test 6: Writing 100000 elements and 25 output steps to netCDF'
+print '  with and without compression'
+print '  (only time spent on writing output is measured)'
+for compression_level in [0, 4]:
+    o = OpenOil3D(loglevel=50) # Quiet
+    o.set_config('processes:turbulentmixing', False)
+    o.set_config('export:compression_level', compression_level)
+    if compression_level > 0:
+        o.export_encoding = {'lon': {'least_significant_digit': 4},
+                             'lat': {'least_significant_digit': 4}}
+    o.fallback_values['x_sea_water_velocity'] = .1
+    o.fallback_values['x_wind'] = 5
+    o.fallback_values['land_binary_mask'] = 0
+    o.seed_elements(lon=4, lat=60, number=100000, radius=10000,
+                    time=datetime(2016, 1, 1))
+    o.run(steps=24, time_step=3600, outfile='performance_test.nc',
+          export_buffer_length=5)
+    time_spent = o.timing['writing output'].total_seconds()
+    size = os.path.getsize('performance_test.nc')/1e6
+    print '%6.1f seconds writing %6.1f MB (%5.1f MB/s of data) ' \
+          'with compression level %i' % (
+              time_spent, size, 100000*25*len(o.history.dtype)*4/1e6 /
+              time_spent, compression_level)
+    os.remove('performance_test.nc')
+
+
+print '--------------------------------------------------------'
+print 'Test 7: Updating positions of 1000000 elements'
+from opendrift.models.physics_methods import displace_positions
+num_points = 1000000
+lon = np.random.uniform(0, 20, num_points)
+lat = np.random.uniform(55, 75, num_points)
+u = np.random.uniform(-1, 1, num_points)
+v = np.random.uniform(-1, 1, num_points)
+reference = None
+for method in ['geodesic', 'tangent-plane']:
+    start_time = datetime.now()
+    new_lon, new_lat = displace_positions(lon, lat, u, v, 900, method)
+    time_spent = datetime.now() - start_time
+    if reference is None:
+        reference = (new_lon, new_lat)
+        error = 0
+    else:
+        from opendrift.models.physics_methods import geod
+        error = geod.inv(new_lon, new_lat, reference[0],
+                         reference[1])[2].max()
+    print '%6.2f seconds with method %s (max deviation %.3f m)' % (
+        time_spent.total_seconds(), method, error)
+
+
+print '--------------------------------------------------------'
+num_processes = max(2, multiprocessing.cpu_count())
+print 'Test 8: Simulation of 50000 elements, run in 1 or %i processes' % \
+    num_processes
+for processes in [1, num_processes]:
+    o = OpenOil3D(loglevel=50) # Quiet
+    o.set_config('processes:turbulentmixing', False)
+    o.fallback_values['x_sea_water_velocity'] = .1
+    o.fallback_values['x_wind'] = 5
+    o.fallback_values['land_binary_mask'] = 0
+    o.seed_elements(lon=4, lat=60, number=50000, radius=10000,
+                    time=datetime(2016, 1, 1))
+    start_time = datetime.now()
+    if processes == 1:
+        o.run(steps=12, time_step=900, time_step_output=3600)
+    else:
+        o.run_parallel(processes=processes, steps=12, time_step=900,
+                       time_step_output=3600)
+    time_spent = datetime.now() - start_time
+    print '%6.2f seconds with %i process(es)' % (
+        time_spent.total_seconds(), processes)
+
+
+
+print '--------------------------------------------------------'
+print 'Test 9: Vertical mixing of 10000 elements, 180 cycles per step'
+print '  with reference scheme and with mixing kernel'
+for model in [OceanDrift3D, OpenOil3D]:
+    reference = None
+    for fast_kernel in [False, True]:
+        np.random.seed(1)
+        o = model(loglevel=50) # Quiet
+        o.set_config('processes:turbulentmixing', True)
+        o.set_config('turbulentmixing:diffusivitymodel',
+                     'windspeed_Sundby1983')
+        o.set_config('turbulentmixing:timestep', 5)
+        o.set_config('turbulentmixing:fast_kernel', fast_kernel)
+        o.fallback_values['x_wind'] = 10
+        o.fallback_values['land_binary_mask'] = 0
+        o.seed_elements(lon=4, lat=60, number=10000, radius=100,
+                        z=-np.random.uniform(0, 30, 10000),
+                        time=datetime(2016, 1, 1))
+        o.run(steps=2, time_step=900)
+        time_spent = o.timing['main loop:updating elements:vertical mixing']
+        if reference is None:
+            reference = o.elements.z.copy()
+        print '%6.2f seconds for %s with %s (mean depth %.2f m, ' \
+              'reference %.2f m)' % (
+                  time_spent.total_seconds(), model.__name__,
+                  'mixing kernel' if fast_kernel else 'reference scheme',
+                  o.elements.z.mean(), reference.mean())
+
 
 print '\n\n'
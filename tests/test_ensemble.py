@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2017, Knut-Frode Dagestad, MET Norway
+
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from opendrift.readers import reader_netCDF_CF_generic
+from opendrift.models.oceandrift import OceanDrift
+from opendrift.models.ensemble import Ensemble, parameter_sweep
+
+
+class TestEnsemble(unittest.TestCase):
+
+    def test_parameter_sweep(self):
+        members = parameter_sweep(
+            seed_elements={'wind_drift_factor': [.01, .02, .03]},
+            config={'drift:scheme': ['euler', 'runge-kutta']})
+        self.assertEqual(len(members), 6)
+        self.assertEqual(members[0]['seed_elements']['wind_drift_factor'],
+                         .01)
+        self.assertRaises(ValueError, parameter_sweep, seed={'lon': [4]})
+
+    def test_ensemble(self):
+        arome = reader_netCDF_CF_generic.Reader(
+            OceanDrift().test_data_folder() +
+            '14Jan2016_NorKyst_z_3d/AROME_MetCoOp_00_DEF.nc_20160114_subset')
+        members = parameter_sweep(
+            seed_elements={'wind_drift_factor': [0, .02, .04]})
+        results = []
+        for processes in [1, 3]:
+            e = Ensemble(OceanDrift, members, readers=[arome],
+                         lon_bins=np.linspace(3, 6, 31),
+                         lat_bins=np.linspace(61, 63, 21),
+                         fallback_values={'land_binary_mask': 0,
+                                          'x_sea_water_velocity': 0,
+                                          'y_sea_water_velocity': 0},
+                         seed_elements={'lon': 4.5, 'lat': 62,
+                                        'radius': 1000, 'number': 100,
+                                        'time': datetime(2016, 1, 14, 0)},
+                         run={'duration': timedelta(hours=2),
+                              'time_step': 900, 'time_step_output': 3600})
+            e.run(processes=processes)
+            results.append(e)
+        serial, parallel = results
+        for s, p in zip(serial.results, parallel.results):
+            self.assertTrue(np.allclose(s['lon'], p['lon']))
+        # No drift without wind drift factor
+        self.assertAlmostEqual(serial.results[0]['lon'].mean(), 4.5, 2)
+        self.assertTrue(np.abs(serial.results[2]['lon'] -
+                               serial.results[1]['lon']).max() > .01)
+        self.assertEqual(len(parallel.times()), 3)
+        self.assertAlmostEqual(parallel.probability().sum(), 1)
+        times, budget = parallel.status_budget()
+        self.assertEqual(budget['active'].tolist(), [100, 100, 100])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,12 +21,16 @@ import unittest
 from datetime import datetime
 
 import numpy as np
+from scipy.ndimage import map_coordinates
 
 from opendrift.models.oceandrift import OceanDrift
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
+from opendrift.readers.curvilinear import CurvilinearGrid
+from opendrift.readers.landfill import LandFillCache
 from opendrift.readers.interpolation import \
-        ReaderBlock, LinearND2DInterpolator, \
+        ReaderBlock, LinearND2DInterpolator, Bilinear2DInterpolator, \
+        Linear2DInterpolator, \
         NDImage2DInterpolator, Nearest2DInterpolator, \
         Nearest1DInterpolator, Linear1DInterpolator
 
@@ -103,6 +107,78 @@ class TestInterpolation(unittest.TestCase):
         self.assertEqual(values[10], 1.6487979858538129)
         self.assertEqual(sum(values.mask), 15)
 
+    def test_interpolation_bilinear(self):
+        xgrid = np.linspace(0, 10, 11)
+        ygrid = np.linspace(20, 0, 5)  # Decreasing
+        xg, yg = np.meshgrid(xgrid, ygrid)
+        data = np.ma.array([2*xg + yg, 3*xg - yg])
+        x = np.array([0, 2.5, 9.9, 10, 4.5, -1, 5])
+        y = np.array([0, 7, 19, 20, 1, 5, 21])
+        interpolator = Bilinear2DInterpolator(xgrid, ygrid, x, y)
+        # Linear fields are reproduced exactly, within grid
+        values = interpolator(data)
+        self.assertEqual(values.shape, (2, 7))
+        self.assertTrue(np.allclose(values[0, 0:5], 2*x[0:5] + y[0:5]))
+        self.assertTrue(np.allclose(values[1, 0:5], 3*x[0:5] - y[0:5]))
+        self.assertTrue(np.all(values.mask[:, 5:7]))
+        # Masked nodes are disregarded
+        data2d = data[0].copy()
+        data2d[4, 4] = np.ma.masked  # Corner of the cell of point 4
+        data2d[2:4, 2:4] = np.nan
+        values = interpolator(data2d)
+        self.assertAlmostEqual(values[4], ((2*4 + 5)*.1 + (2*5 + 5)*.1 +
+                                           (2*5 + 0)*.4)/.6)
+        self.assertFalse(values.mask[4])
+        self.assertTrue(values.mask[1])  # All nodes of cell invalid
+        self.assertAlmostEqual(values[0], 0)
+
+    def test_interpolator_reuse(self):
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        data_dict2, x, y, z = self.get_synthetic_data_dict()
+        data_dict2['var3d'] = data_dict2['var3d']*2
+        del data_dict2['var2d']
+        for method in ['nearest', 'ndimage', 'linearND', 'linearNDFast']:
+            b1 = ReaderBlock(data_dict.copy(),
+                             interpolation_horizontal=method)
+            b2 = ReaderBlock(data_dict2.copy(),
+                             interpolation_horizontal=method)
+            env1, prof1 = b1.interpolate(x, y, z.copy(), ['var3d'],
+                                         profiles=['var3d'])
+            # Layers are interpolated as separate 2D arrays
+            layer = b1.interpolator2d(b1.data_dict['var3d'][1])
+            self.assertTrue(np.allclose(
+                np.ma.filled(prof1['var3d'][1], np.nan),
+                np.ma.filled(layer, np.nan), equal_nan=True))
+            env2, prof2 = b2.interpolate(x, y, z.copy(), ['var3d'])
+            # Same result with interpolator shared from other block
+            b3 = ReaderBlock(data_dict2.copy(),
+                             interpolation_horizontal=method)
+            b3.share_interpolators(b1)
+            env3, prof3 = b3.interpolate(x, y, z.copy(), ['var3d'])
+            self.assertTrue(b3.interpolator2d is b1.interpolator2d)
+            self.assertTrue(np.allclose(
+                np.ma.filled(env2['var3d'], np.nan),
+                np.ma.filled(env3['var3d'], np.nan), equal_nan=True))
+
+    def test_land_fill(self):
+        data = np.ma.array(np.arange(2*8*10, dtype=np.float32).reshape(
+            (2, 8, 10)))
+        data[:, :, 2:] = np.ma.masked  # Land east of x=1
+        data[1, :, :] = np.ma.masked  # No valid values in second layer
+        cache = LandFillCache()
+        filled = Linear2DInterpolator.prepare(data, cache)
+        # Filled from nearest valid cell, up to five cells
+        self.assertTrue(np.all(filled[0, :, 2:7] ==
+                               data[0, :, 1:2].data))
+        self.assertTrue(np.all(filled.mask[0, :, 7:]))
+        self.assertTrue(np.all(np.isnan(filled.data[0, :, 7:])))
+        self.assertFalse(filled.mask[0, :, 0:7].any())
+        self.assertTrue(np.all(filled.mask[1]))
+        # Index map is reused for data with same mask
+        index_map = cache.get(data.mask)
+        self.assertTrue(cache.get(np.ma.getmaskarray(2*data)) is index_map)
+        self.assertEqual(len(cache.index_maps), 1)
+
     def test_interpolation_vertical(self):
 
         # 3 elements, 4 depths
@@ -247,6 +323,40 @@ class TestInterpolation(unittest.TestCase):
         self.assertAlmostEqual(prof['x_sea_water_velocity'][5,48],
                                -0.090, 2)
 
+    def test_curvilinear_grid(self):
+        """Inverse mapping lon,lat -> x,y of unprojected grid"""
+        jj, ii = np.mgrid[0:60, 0:80].astype(np.float64)
+        lon = 5 + 0.02*ii + 0.01*jj + 0.1*np.sin(jj/20.)
+        lat = 60 + 0.01*jj - 0.005*ii + 0.0001*ii**2
+        grid = CurvilinearGrid(lon, lat, xmin=10, ymin=20)
+        np.random.seed(0)
+        x = np.random.uniform(0, 79, 1000)
+        y = np.random.uniform(0, 59, 1000)
+        # Positions from bilinear interpolation, as in xy2lonlat
+        lons = map_coordinates(lon, [y, x], order=1)
+        lats = map_coordinates(lat, [y, x], order=1)
+        xi, yi = grid.lonlat2xy(lons, lats)
+        self.assertTrue(np.allclose(xi, x + 10))
+        self.assertTrue(np.allclose(yi, y + 20))
+        # Outside grid
+        xi, yi = grid.lonlat2xy([lon[0, 0] - 1, 100, np.nan],
+                                [lat[0, 0], 10, 60])
+        self.assertTrue(np.all(np.isnan(xi)))
+        self.assertTrue(np.all(np.isnan(yi)))
+
+        # Nodes with NaN coordinates (e.g. land) give NaN for positions
+        # in cells using these nodes, and do not affect other positions
+        x = np.array([40.5, 41.2, 39.5, 10.3, 70.8])
+        y = np.array([30.5, 31.7, 29.5, 5.6, 50.1])
+        lons = map_coordinates(lon, [y, x], order=1)
+        lats = map_coordinates(lat, [y, x], order=1)
+        lon[30:32, 40:42] = np.nan
+        grid = CurvilinearGrid(lon, lat)
+        xi, yi = grid.lonlat2xy(lons, lats)
+        self.assertTrue(np.all(np.isnan(xi[0:3])))
+        self.assertTrue(np.all(np.isnan(yi[0:3])))
+        self.assertTrue(np.allclose(xi[3:], x[3:]))
+        self.assertTrue(np.allclose(yi[3:], y[3:]))
 
 if __name__ == '__main__':
     unittest.main()
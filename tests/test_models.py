@@ -20,6 +20,8 @@
 import unittest
 from datetime import datetime, timedelta
 
+import numpy as np
+
 from opendrift.readers import reader_ArtificialOceanEddy
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_constant
@@ -68,8 +70,8 @@ class TestModels(unittest.TestCase):
         s.seed_elements(lon=2, lat=60, time=datetime.now(), number=1,
                         length=80, beam=14, height=25, draft=5)
         s.run(time_step=600, duration=timedelta(hours=4))
-        self.assertAlmostEqual(s.elements.lon, 2.25267706)
-        self.assertAlmostEqual(s.elements.lat, 59.87694775)
+        self.assertAlmostEqual(s.elements.lon, 2.25267494)
+        self.assertAlmostEqual(s.elements.lat, 59.87694665)
 
     def test_shipdrift_backwards(self):
         """Case above, reversed"""
@@ -90,6 +92,32 @@ class TestModels(unittest.TestCase):
         self.assertAlmostEqual(s.elements.lon, 2.0, 3)
         self.assertAlmostEqual(s.elements.lat, 60, 3)
 
+    def test_shipdrift_wave_force_coefficient(self):
+        s = ShipDrift(loglevel=50)
+        bl = np.array([0.145, 0.133, 0.145, 0.162])
+        dl = np.array([0.047, 0.041, 0.047, 0.033])
+        f = s.wave_force_coefficient(bl, dl)
+        self.assertEqual(f.shape, (len(s.wave_force_omega), 4))
+        for i, omega in enumerate(s.wave_force_omega):
+            if omega < s.wave_force_omega_interval3:
+                np.testing.assert_array_almost_equal(
+                    f[i, :], s.wforce_interpolator_F(omega, bl, dl))
+            else:
+                np.testing.assert_array_equal(f[i, :], 0.5)
+        # Coefficients are interpolated once per element, by ID
+        length = np.array([100., 120., 100., 90.])
+        s.seed_elements(lon=2, lat=60, time=datetime.now(), number=4,
+                        length=length, beam=bl*length, draft=dl*length)
+        s.prepare_run()
+        self.assertEqual(s.wave_force_coefficients.shape,
+                         (len(s.wave_force_omega), 4))
+        ID = s.elements_scheduled.ID
+        np.testing.assert_array_almost_equal(
+            s.wave_force_coefficients[:, ID - 1],
+            s.wave_force_coefficient(
+                s.elements_scheduled.beam/s.elements_scheduled.length,
+                s.elements_scheduled.draft/s.elements_scheduled.length))
+
 
 
 if __name__ == '__main__':
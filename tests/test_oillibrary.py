@@ -130,6 +130,20 @@ class TestOil(unittest.TestCase):
                 #self.assertAlmostEqual(d.mean(), 0.000072158)
                 self.assertAlmostEqual(d.mean(), 0.00007332542)
 
+    @unittest.skipIf(has_oil_library is False,
+                     'NOAA OilLibrary is needed')
+    def test_oil_property_table(self):
+        o = OpenOil3D(loglevel=50, weathering_model='noaa')
+        o.seed_elements(lon=4.8, lat=60, number=10,
+                        time=datetime.now(), oiltype='SKRUGARD')
+        o.prepare_run()
+        temperature = np.array([265, 271.3, 280.55, 293.01, 320])
+        viscosity, density = o.oil_properties_at_temperature(temperature)
+        viscosity_direct, density_direct = \
+            o.oil_property_table(temperature)[1:]
+        np.testing.assert_allclose(viscosity, viscosity_direct, rtol=1e-3)
+        np.testing.assert_allclose(density, density_direct, rtol=1e-5)
+
 
 if __name__ == '__main__':
     unittest.main()
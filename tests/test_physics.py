@@ -28,6 +28,7 @@ from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.models.openoil3D import OpenOil3D
+from opendrift.models.physics_methods import displace_positions, geod
 
 
 class TestRun(unittest.TestCase):
@@ -184,6 +185,47 @@ class TestRun(unittest.TestCase):
         self.assertAlmostEqual(o.elements.z.min(), -28.0, 1)
         ########################################################
 
+    def test_displace_positions(self):
+        lon = np.array([4., 4., 4., 179.999])
+        lat = np.array([60., 60., 85., 0.])
+        u = np.array([1., 0., -0.5, 1.])
+        v = np.array([0., 1., 0.5, 0.])
+        glon, glat = displace_positions(lon, lat, u, v, 900, 'geodesic')
+        dist = geod.inv(lon, lat, glon, glat)[2]
+        np.testing.assert_array_almost_equal(dist, 900*np.hypot(u, v), 3)
+        tlon, tlat = displace_positions(lon, lat, u, v, 900, 'tangent-plane')
+        self.assertTrue(geod.inv(glon, glat, tlon, tlat)[2].max() < 1)
+        self.assertTrue(tlon[3] < -179)  # Wrapped across dateline
+        self.assertRaises(ValueError, displace_positions,
+                          lon, lat, u, v, 900, 'euclidean')
+
+
+    def test_parameterised_waves(self):
+        o = OpenOil3D(loglevel=20, weathering_model='default')
+        np.random.seed(0)
+        x_wind = np.random.uniform(-20, 20, 200)
+        y_wind = np.random.uniform(-20, 20, 200)
+        x_wind[0:3] = [0, 29.5, 3]  # Calm, and maximum of tables
+        y_wind[0:3] = [0, 0, 4]  # Exactly 5 m/s
+        for fetch in [5000, 25000, 10000, 50000]:
+            xs, ys = o.wave_stokes_drift_parameterised_array(
+                x_wind, y_wind, fetch)
+            hs = o.wave_significant_height_parameterised_array(
+                x_wind, y_wind, fetch)
+            for i in range(len(x_wind)):
+                wind = (x_wind[i], y_wind[i])
+                xsi, ysi = o.wave_stokes_drift_parameterised(wind, fetch)
+                self.assertAlmostEqual(xs[i], xsi)
+                self.assertAlmostEqual(ys[i], ysi)
+                self.assertAlmostEqual(hs[i],
+                    o.wave_significant_height_parameterised(wind, fetch))
+        # Fetch from config is a string
+        self.assertTrue(np.all(
+            o.wave_significant_height_parameterised_array(
+                x_wind, y_wind, '50000') == hs))
+        hs = o.wave_significant_height_parameterised_array(
+            np.array([np.nan]), np.array([1.]), 5000)
+        self.assertTrue(np.isnan(hs[0]))
 
 if __name__ == '__main__':
     unittest.main()
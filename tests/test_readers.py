@@ -17,10 +17,14 @@
 #
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
+import os
+import shutil
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 
 import numpy as np
+import pyproj
 
 from opendrift.models.oceandrift import OceanDrift
 from opendrift.models.openoil3D import OpenOil3D
@@ -28,6 +32,8 @@ from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_constant
+from opendrift.readers import reader_ArtificialOceanEddy
+from opendrift.readers import blockcache
 from opendrift.models.pelagicegg import PelagicEggDrift
 
 
@@ -36,6 +42,26 @@ basemap = reader_basemap_landmask.Reader(
             llcrnrlon=-1.5, llcrnrlat=59,
             urcrnrlon=7, urcrnrlat=64, resolution='c')
 
+class TimeDependentEddy(reader_ArtificialOceanEddy.Reader):
+    """Eddy with hourly fields of increasing strength, counting reads"""
+
+    def __init__(self, *args, **kwargs):
+        self.times_read = []
+        super(TimeDependentEddy, self).__init__(*args, **kwargs)
+        self.start_time = datetime(2017, 1, 1)
+        self.end_time = datetime(2017, 1, 2)
+        self.time_step = timedelta(hours=1)
+
+    def get_variables(self, *args, **kwargs):
+        variables = super(TimeDependentEddy, self).get_variables(
+            *args, **kwargs)
+        hours = (variables['time'] - self.start_time).total_seconds()/3600.
+        for var in self.variables:
+            variables[var] = variables[var]*(1 + hours)
+        self.times_read.append(variables['time'])
+        return variables
+
+
 class TestReaders(unittest.TestCase):
     """Tests for readers"""
 
@@ -283,5 +309,244 @@ class TestReaders(unittest.TestCase):
         o.seed_elements(lon=4, lat=60, time=r.start_time, number=5)
         o.run(steps=3)
 
+    def test_reader_threads(self):
+        """Concurrent retrieval of reader groups gives identical results"""
+        o = OceanDrift(loglevel=30)
+        cw = reader_constant.Reader({'x_wind': 5, 'y_wind': 6})
+        cc = reader_constant.Reader({'x_sea_water_velocity': 0,
+                                     'y_sea_water_velocity': .2})
+        cc.name = 'constant_current'
+        o.add_reader([cw, cc])
+        o.fallback_values['land_binary_mask'] = 0
+        self.assertEqual(o._independent_reader_groups(
+            [['a'], ['b', 'c'], ['d'], ['c']]), [[0], [1, 3], [2]])
+        lon = np.linspace(3, 5, 10)
+        lat = np.linspace(59, 61, 10)
+        time = datetime(2016, 2, 2)
+        env, env_profiles, missing = o.get_environment(
+            o.required_variables, time, lon, lat, 0*lon, None)
+        o.set_config('general:reader_threads', 4)
+        env2, env_profiles2, missing2 = o.get_environment(
+            o.required_variables, time, lon, lat, 0*lon, None)
+        for var in o.required_variables:
+            self.assertItemsEqual(env[var], env2[var])
+        self.assertEqual(env2['y_wind'][3], 6)
+        self.assertAlmostEqual(env2['y_sea_water_velocity'][3], .2)
+        self.assertFalse(missing2.any())
+        self.assertTrue('main loop:readers:constant_current' in o.timing)
+        # Timers of readers are not left open by worker threads
+        self.assertFalse(any(category.startswith('main loop:readers:')
+                             for category in getattr(o, 'timers', {})))
+
+    def test_prefetch(self):
+        """Prefetched blocks are used and give identical results"""
+        r = TimeDependentEddy(2, 62)
+        rp = TimeDependentEddy(2, 62)
+        rp.prefetch = True
+        self.assertEqual(r.time_following(datetime(2017, 1, 1, 1)),
+                         datetime(2017, 1, 1, 2))
+        self.assertEqual(r.time_following(datetime(2017, 1, 1, 1, 30),
+                                          forward=False),
+                         datetime(2017, 1, 1, 1))
+        self.assertEqual(r.time_following(r.end_time), None)
+        lon = np.linspace(1.5, 2.5, 10)
+        lat = np.linspace(61.5, 62.5, 10)
+        variables = ['x_sea_water_velocity', 'y_sea_water_velocity']
+        for minutes in range(0, 240, 30):
+            time = r.start_time + timedelta(minutes=minutes)
+            env, p = r.get_variables_interpolated(
+                variables, time=time, lon=lon, lat=lat, z=0*lon, block=True)
+            envp, pp = rp.get_variables_interpolated(
+                variables, time=time, lon=lon, lat=lat, z=0*lon, block=True)
+            for var in variables:
+                self.assertTrue(np.allclose(env[var], envp[var]))
+        # Each time is read only once, and the next block is prefetched
+        self.assertEqual(r.times_read,
+                         [r.start_time + timedelta(hours=h)
+                          for h in range(5)])
+        rp.var_block_prefetch[str(variables)][1].join()
+        self.assertEqual(sorted(rp.times_read),
+                         [r.start_time + timedelta(hours=h)
+                          for h in range(6)])
+
+    def test_fast_time_interpolation(self):
+        lon = np.array([1.5, 2, 2.5, 30])
+        lat = np.array([61.5, 62, 62.5, 62])  # Last is outside coverage
+        variables = ['x_sea_water_velocity', 'y_sea_water_velocity']
+        envs = []
+        for fast in [True, False]:
+            r = TimeDependentEddy(2, 62)
+            r.fast_time_interpolation = fast
+            env, p = r.get_variables_interpolated(
+                variables, time=r.start_time + timedelta(minutes=90),
+                lon=lon, lat=lat, z=0*lon, block=True)
+            envs.append(env)
+        fast, masked = envs
+        for var in variables:
+            self.assertFalse(isinstance(fast[var], np.ma.MaskedArray))
+            self.assertEqual(fast[var].dtype, np.float32)
+            self.assertTrue(np.allclose(fast[var],
+                                        np.ma.filled(masked[var], np.nan),
+                                        equal_nan=True))
+            self.assertTrue(np.isnan(fast[var][-1]))
+            self.assertFalse(np.isnan(fast[var][0:3]).any())
+
+        # Elements missing from first reader are taken from next
+        for fast in [True, False]:
+            o = OceanDrift(loglevel=30)
+            r = TimeDependentEddy(2, 62)
+            r.fast_time_interpolation = fast
+            c = reader_constant.Reader({'x_sea_water_velocity': .3,
+                                        'y_sea_water_velocity': .4})
+            o.add_reader([r, c])
+            env, env_profiles = o._get_environment_group(
+                variables, [r.name, c.name], r.start_time +
+                timedelta(minutes=90), lon, lat, 0*lon, None)
+            for var in variables:
+                self.assertFalse(env[var].mask.any())
+                self.assertTrue(np.allclose(env[var][0:3],
+                                            envs[0][var][0:3]))
+            # Vector is rotated to model projection, keeping speed
+            self.assertAlmostEqual(np.hypot(
+                env['x_sea_water_velocity'][3],
+                env['y_sea_water_velocity'][3]), .5, 6)
+            # and are masked if no reader provides them
+            env, env_profiles = o._get_environment_group(
+                variables, [r.name], r.start_time +
+                timedelta(minutes=90), lon, lat, 0*lon, None)
+            self.assertTrue(env['x_sea_water_velocity'].mask[3])
+            self.assertFalse(env['x_sea_water_velocity'].mask[0:3].any())
+
+    def test_block_cache(self):
+        r = TimeDependentEddy(2, 62)
+        r.set_block_cache_size(100e6)
+        lon = np.linspace(1.5, 2.5, 10)
+        lat = np.linspace(61.5, 62.5, 10)
+        variables = ['x_sea_water_velocity', 'y_sea_water_velocity']
+        # Forwards and then backwards in time
+        minutes = range(0, 180, 30)
+        for m in minutes + minutes[::-1]:
+            time = r.start_time + timedelta(minutes=m)
+            env, p = r.get_variables_interpolated(
+                variables, time=time, lon=lon, lat=lat, z=0*lon, block=True)
+        self.assertEqual(r.times_read,
+                         [r.start_time + timedelta(hours=h)
+                          for h in range(4)])
+        self.assertEqual(len(r.block_cache.blocks), 4)
+        self.assertTrue(r.block_cache.hits > 0)
+        # Cache with room for only two blocks
+        r = TimeDependentEddy(2, 62)
+        r.set_block_cache_size(1)
+        time = r.start_time
+        env, p = r.get_variables_interpolated(
+            variables, time=time, lon=lon, lat=lat, z=0*lon, block=True)
+        self.assertEqual(len(r.block_cache.blocks), 0)  # Block too large
+        blocksize = blockcache.block_size(
+            r.var_block_before[str(variables)])
+        r.set_block_cache_size(2.5*blocksize)
+        for m in minutes + minutes[::-1]:
+            time = r.start_time + timedelta(minutes=m)
+            env, p = r.get_variables_interpolated(
+                variables, time=time, lon=lon, lat=lat, z=0*lon, block=True)
+        self.assertEqual(len(r.block_cache.blocks), 2)
+        self.assertTrue(r.block_cache.num_bytes <= 2.5*blocksize)
+        self.assertTrue(r.block_cache.evictions > 0)
+
+    def test_shared_block_cache(self):
+        variables = ['x_sea_water_velocity', 'y_sea_water_velocity']
+        lon = np.linspace(1.5, 2.5, 10)
+        lat = np.linspace(61.5, 62.5, 10)
+        readers = [TimeDependentEddy(2, 62) for i in range(3)]
+        blockcache.set_shared_block_cache_size(100e6)
+        for r in readers[0:2]:
+            r.set_block_cache_size(shared=True)
+        envs = []
+        for r in readers:
+            for minutes in range(0, 120, 30):
+                time = r.start_time + timedelta(minutes=minutes)
+                env, p = r.get_variables_interpolated(
+                    variables, time=time, lon=lon, lat=lat, z=0*lon,
+                    block=True)
+            envs.append(env)
+        self.assertTrue(readers[0].block_cache is readers[1].block_cache)
+        self.assertEqual(len(readers[0].times_read), 3)
+        self.assertEqual(len(readers[1].times_read), 0)  # All from cache
+        self.assertEqual(len(readers[2].times_read), 3)  # Not shared
+        for var in variables:
+            self.assertTrue(np.allclose(envs[0][var], envs[1][var]))
+            self.assertTrue(np.allclose(envs[0][var], envs[2][var]))
+        readers[1].set_block_cache_size(0)
+        self.assertFalse(readers[0].block_cache is readers[1].block_cache)
+        # Leaving the shared cache does not clear or resize it
+        self.assertTrue(len(blockcache.shared_block_cache.blocks) > 0)
+        self.assertEqual(blockcache.shared_block_cache.max_bytes, 100e6)
+        self.assertRaises(ValueError, readers[1].set_block_cache_size,
+                          100e6, shared=True)
+
+        # Readers of other data do not share blocks
+        other = TimeDependentEddy(3, 62)
+        other.set_block_cache_size(shared=True)
+        other.get_variables_interpolated(
+            variables, time=other.start_time, lon=lon, lat=lat, z=0*lon,
+            block=True)
+        self.assertEqual(len(other.times_read), 1)
+        c1 = reader_constant.Reader({'x_wind': 5})
+        c2 = reader_constant.Reader({'x_wind': 6})
+        self.assertNotEqual(c1.data_source(), c2.data_source())
+        blockcache.set_shared_block_cache_size(0)
+        self.assertEqual(len(blockcache.shared_block_cache.blocks), 0)
+
+    def test_data_source_of_file(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'arome.nc')
+        shutil.copy(o.test_data_folder() +
+            '14Jan2016_NorKyst_z_3d/AROME_MetCoOp_00_DEF.nc_20160114_subset',
+            filename)
+        r = reader_netCDF_CF_generic.Reader(filename)
+        source = r.data_source()
+        self.assertEqual(source, r.data_source())
+        # Rewritten file is a new data source
+        os.utime(filename, (0, 0))
+        self.assertNotEqual(source, r.data_source())
+        shutil.rmtree(os.path.dirname(filename))
+
+    def test_metadata_cache(self):
+        filename = o.test_data_folder() + \
+            '14Jan2016_NorKyst_z_3d/AROME_MetCoOp_00_DEF.nc_20160114_subset'
+        cache_dir = tempfile.mkdtemp()
+        read_metadata = reader_netCDF_CF_generic.Reader.read_metadata
+        try:
+            reader_netCDF_CF_generic.Reader.cache_dir = cache_dir
+            r1 = reader_netCDF_CF_generic.Reader(filename)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            # Second reader shall not scan the file
+            reader_netCDF_CF_generic.Reader.read_metadata = None
+            r2 = reader_netCDF_CF_generic.Reader(filename)
+        finally:
+            reader_netCDF_CF_generic.Reader.read_metadata = read_metadata
+            del reader_netCDF_CF_generic.Reader.cache_dir
+            shutil.rmtree(cache_dir)
+        for attribute in r1.cached_attributes:
+            if hasattr(r1, attribute):
+                self.assertTrue(np.all(getattr(r1, attribute) ==
+                                       getattr(r2, attribute)))
+        self.assertEqual(r1.proj4, r2.proj4)
+        self.assertItemsEqual(r1.variables, r2.variables)
+
+    def test_rotation_field(self):
+        r = reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+            '14Jan2016_NorKyst_z_3d/AROME_MetCoOp_00_DEF.nc_20160114_subset')
+        proj_to = pyproj.Proj('+proj=stere +lat_0=90 +lon_0=70 +lat_ts=60')
+        x = np.linspace(r.xmin, r.xmax, 50)
+        y = np.linspace(r.ymin, r.ymax, 50)
+        u = np.ones(50)
+        v = np.zeros(50)
+        u_rot, v_rot = r.rotate_vectors(x, y, u, v, r.proj, proj_to)
+        self.assertEqual(r.rotation_fields.keys(), [proj_to.srs])
+        r.rotation_grid_nodes = 0
+        u_exact, v_exact = r.rotate_vectors(x, y, u, v, r.proj, proj_to)
+        self.assertTrue(np.abs(v_exact).max() > .1)
+        self.assertTrue(np.allclose(u_rot, u_exact, atol=1e-5))
+        self.assertTrue(np.allclose(v_rot, v_exact, atol=1e-5))
+
 if __name__ == '__main__':
     unittest.main()
@@ -23,12 +23,16 @@ import os
 import inspect
 
 import numpy as np
+from netCDF4 import Dataset
 
 from opendrift.readers import reader_ArtificialOceanEddy
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.models.oceandrift import OceanDrift
+from opendrift.models.history import History
+from opendrift.export import io_netcdf
+from opendrift.export.io_netcdf import NetCDFHistory
 from opendrift.models.oceandrift3D import OceanDrift3D
 from opendrift.models.openoil3D import OpenOil3D
 from opendrift.models.pelagicegg import PelagicEggDrift
@@ -251,8 +255,253 @@ class TestRun(unittest.TestCase):
         self.assertTrue(self.o.history['lon'].min() > -1000)
         self.assertTrue(self.o.history['lon'].mask[5,5])
         self.assertFalse(self.o.history['lon'].mask[1,1])
+        # Imported history is of same type as after a run
+        self.assertTrue(isinstance(self.o.history, History))
+        self.assertTrue(isinstance(self.o.history[1, :], History))
+        self.assertTrue(np.all(self.o.history[1, :]['lon'] ==
+                               self.o.history['lon'][1, :]))
         os.remove('temporal_seed.nc')
 
+    def test_netcdf_fixed_dimensions(self):
+        """Output file is written with final dimensions, no rewrite"""
+        o = OceanDrift(loglevel=20)
+        o.fallback_values['x_sea_water_velocity'] = .5
+        o.fallback_values['land_binary_mask'] = 0
+        o.seed_elements(lon=4, lat=60, radius=1000, number=10,
+                        time=datetime(2016, 9, 16))
+        outfile = 'fixed_dimensions.nc'
+        o.run(steps=10, time_step=1800, time_step_output=3600,
+              outfile=outfile, export_buffer_length=2)
+        nc = Dataset(outfile)
+        self.assertFalse(nc.dimensions['time'].isunlimited())
+        self.assertEqual(len(nc.dimensions['time']), 6)
+        self.assertEqual(len(nc.dimensions['trajectory']), 10)
+        self.assertAlmostEqual(nc.variables['lon'][3, -1],
+                               o.elements.lon[3], 4)
+        nc.close()
+        os.remove(outfile)
+
+        # Deactivated elements are kept, still without rewrite
+        o = OceanDrift(loglevel=20)
+        o.fallback_values['x_sea_water_velocity'] = .5
+        o.fallback_values['land_binary_mask'] = 0
+        o.set_config('drift:max_age_seconds', 4*3600)
+        o.seed_elements(lon=4, lat=60, radius=1000, number=5,
+                        time=datetime(2016, 9, 16))
+        o.seed_elements(lon=4, lat=60, radius=1000, number=5,
+                        time=datetime(2016, 9, 16, 2))
+        rewrites = []
+        move = io_netcdf.move
+        io_netcdf.move = lambda *args: rewrites.append(args)
+        try:
+            o.run(steps=10, time_step=1800, time_step_output=3600,
+                  outfile=outfile, export_buffer_length=2)
+        finally:
+            io_netcdf.move = move
+        self.assertEqual(o.num_elements_deactivated(), 5)
+        self.assertEqual(rewrites, [])
+        nc = Dataset(outfile)
+        self.assertEqual(len(nc.dimensions['time']), 6)
+        self.assertEqual(len(nc.dimensions['trajectory']), 10)
+        self.assertEqual(nc.variables['lon'][0:5, 4].count(), 5)
+        nc.close()
+        os.remove(outfile)
+
+        # Output beyond the fixed time dimension gives a clear error
+        o.outfile_name = outfile
+        o.outfile = Dataset(outfile, 'w')
+        o.outfile.createDimension('time', 6)
+        self.assertRaises(ValueError, io_netcdf.check_time_dimension, o, 7)
+        io_netcdf.check_time_dimension(o, 6)
+        o.outfile.close()
+        os.remove(outfile)
+
+    def test_history_from_file(self):
+        """History is read from file after run with export buffer"""
+        histories = []
+        for outfile, export_buffer_length in [(None, None),
+                                              ('history_from_file.nc', 3)]:
+            o = OceanDrift(loglevel=20)
+            o.fallback_values['x_sea_water_velocity'] = .5
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, radius=1000, number=10,
+                            time=datetime(2016, 9, 16))
+            o.run(steps=10, time_step=1800, time_step_output=3600,
+                  outfile=outfile,
+                  export_buffer_length=export_buffer_length)
+            histories.append(o.history)
+            lon, status = o.get_property('lon')
+        self.assertTrue(isinstance(o.history, NetCDFHistory))
+        self.assertEqual(o.history.shape, histories[0].shape)
+        self.assertTrue(np.allclose(histories[0]['lon'],
+                                    histories[1]['lon']))
+        self.assertTrue(np.allclose(histories[0]['lon'][2, 1:4],
+                                    histories[1][2, 1:4]['lon']))
+        # Subsets are views, read from file only when needed
+        last = o.history[:, -1]
+        self.assertTrue(isinstance(last, NetCDFHistory))
+        self.assertEqual(last.shape, (10,))
+        self.assertTrue(np.allclose(last['lon'], histories[0]['lon'][:, -1]))
+        subset = o.history[[1, 4, 8], ::2][1:, 1]
+        self.assertEqual(subset.shape, (2,))
+        self.assertTrue(np.allclose(subset['lat'],
+                                    histories[0]['lat'][[4, 8], 2]))
+        self.assertTrue(np.allclose(subset.to_masked_array()['lat'],
+                                    subset['lat']))
+        self.assertEqual(lon.shape, (6, 10))
+        os.remove('history_from_file.nc')
+
+    def test_history_float_dtype(self):
+        lons = []
+        for float_dtype in ['native', 'float16']:
+            o = OceanDrift(loglevel=20)
+            o.set_config('general:history_float_dtype', float_dtype)
+            o.fallback_values['x_sea_water_velocity'] = .5
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, radius=1000, number=10,
+                            time=[datetime(2016, 9, 16),
+                                  datetime(2016, 9, 16, 3)])
+            o.run(steps=10, time_step=1800, time_step_output=3600)
+            lons.append(o.history['lon'])
+        self.assertEqual(o.history.dtype['lon'], np.float32)
+        self.assertEqual(o.history.dtype['z'], np.float16)
+        self.assertEqual(o.history['x_sea_water_velocity'].dtype,
+                         np.float16)
+        self.assertTrue(np.all(lons[0] == lons[1]))
+        # Elements seeded later are masked before seeding
+        self.assertTrue(o.history['lon'].mask[9, 0])
+        self.assertFalse(o.history['lon'].mask[9, 3])
+        history = o.history.to_masked_array()
+        self.assertTrue(np.all(history['lon'] == o.history['lon']))
+        self.assertTrue(np.all(history['lon'].mask ==
+                               o.history['lon'].mask))
+
+    def test_netcdf_compression(self):
+        sizes = []
+        for compression_level in [0, 4]:
+            o = OceanDrift(loglevel=20)
+            o.set_config('export:compression_level', compression_level)
+            if compression_level > 0:
+                o.export_encoding = {
+                    'lon': {'least_significant_digit': 4},
+                    'z': {'dtype': 'i2', 'scale_factor': .01,
+                          'add_offset': 0}}
+            o.fallback_values['x_sea_water_velocity'] = .5
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, radius=1000, number=1000,
+                            z=-np.linspace(0, 10, 1000),
+                            time=datetime(2016, 9, 16))
+            o.run(steps=10, time_step=1800, time_step_output=3600,
+                  outfile='compression.nc', export_buffer_length=4)
+            sizes.append(os.path.getsize('compression.nc'))
+            nc = Dataset('compression.nc')
+            self.assertEqual(nc.variables['lon'].chunking(), [1000, 4])
+            self.assertEqual(nc.variables['lon'].filters()['zlib'],
+                             compression_level > 0)
+            lon = nc.variables['lon'][:, -1]
+            z = nc.variables['z'][:, -1]
+            nc.close()
+            os.remove('compression.nc')
+        self.assertTrue(sizes[1] < sizes[0]/2)
+        self.assertTrue(np.allclose(lon, o.elements.lon, atol=1e-4))
+        self.assertTrue(np.allclose(z, o.elements.z, atol=.01))
+        self.assertTrue(np.abs(z - o.elements.z).max() > 0)  # Packed
+
+    def test_add_velocity(self):
+        # Current and wind drift are summed, and applied once per step
+        lons = []
+        for current, wind in [(.5, 0), (.3, 10)]:
+            o = OceanDrift(loglevel=20)
+            o.fallback_values['x_sea_water_velocity'] = current
+            o.fallback_values['x_wind'] = wind
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, number=10, radius=1000,
+                            wind_drift_factor=.02, time=datetime.now())
+            o.run(steps=5, time_step=900)
+            lons.append(o.elements.lon)
+        self.assertTrue(np.allclose(lons[0], lons[1], atol=1e-10))
+        self.assertEqual(o.velocity_contributions.keys(),
+                         ['ocean_current', 'wind_drift'])
+        self.assertAlmostEqual(
+            o.velocity_contributions['wind_drift'][0].max(), .2)
+
+    def test_run_parallel(self):
+        runs = []
+        for processes in [None, 3]:
+            o = OceanDrift(loglevel=30)
+            o.fallback_values['x_sea_water_velocity'] = .2
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, radius=1000, number=100,
+                            time=[datetime(2016, 9, 16),
+                                  datetime(2016, 9, 16, 2)])
+            if processes is None:
+                o.run(steps=8, time_step=900, time_step_output=1800)
+            else:
+                o.run_parallel(processes=processes, steps=8, time_step=900,
+                               time_step_output=1800, outfile='parallel.nc')
+            runs.append(o)
+        serial, parallel = runs
+        self.assertEqual(parallel.history.shape, (100, 5))
+        for var in ['lon', 'z', 'status']:
+            self.assertTrue(np.all(serial.history[var] ==
+                                   parallel.history[var]))
+        self.assertItemsEqual(parallel.elements.ID, range(1, 101))
+        nc = Dataset('parallel.nc')
+        lon = nc.variables['lon'][:]
+        nc.close()
+        os.remove('parallel.nc')
+        self.assertTrue(np.allclose(lon, serial.history['lon']))
+
+        # Partition with no element released during the run
+        runs = []
+        for parallel in [False, True]:
+            o = OceanDrift(loglevel=30)
+            o.fallback_values['x_sea_water_velocity'] = .2
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4, lat=60, number=1,
+                            time=datetime(2016, 9, 16))
+            o.seed_elements(lon=4, lat=60, number=1,
+                            time=datetime(2016, 9, 16, 2))
+            if parallel is True:
+                o.run_parallel(processes=2, steps=8, time_step=900)
+            else:
+                o.run(steps=8, time_step=900)
+            runs.append(o)
+        serial, parallel = runs
+        self.assertEqual(parallel.history.shape, serial.history.shape)
+        self.assertTrue(np.all(serial.history['lon'] ==
+                               parallel.history['lon']))
+        self.assertTrue(parallel.history['lon'].mask[1, :].all())
+        self.assertEqual(parallel.num_elements_scheduled(), 1)
+
+    def test_element_chunks(self):
+        # Same result when environment and update are processed in chunks
+        runs = []
+        for chunk_size in [0, 30]:
+            o = OceanDrift(loglevel=30)
+            o.add_reader(reader_ArtificialOceanEddy.Reader(2, 62))
+            o.fallback_values['x_wind'] = 5
+            o.fallback_values['land_binary_mask'] = 0
+            o.set_config('general:element_chunk_size', chunk_size)
+            o.seed_elements(lon=2, lat=62, radius=20000, number=100,
+                            time=datetime(2016, 9, 16))
+            o.run(steps=5, time_step=900)
+            runs.append(o)
+        for var in ['lon', 'lat', 'x_sea_water_velocity', 'status']:
+            self.assertTrue(np.all(runs[0].history[var] ==
+                                   runs[1].history[var]))
+        # Fallback profiles have one column per element
+        o = PelagicEggDrift(loglevel=30)
+        o.set_config('general:element_chunk_size', 40)
+        lon = np.linspace(4, 5, 100)
+        env, env_profiles, missing = o.get_environment(
+            o.required_variables, datetime(2016, 9, 16), lon, lon + 56,
+            -np.ones(100), o.required_profiles)
+        self.assertEqual(len(env), 100)
+        self.assertEqual(len(missing), 100)
+        self.assertEqual(env_profiles['sea_water_temperature'].shape,
+                         (len(env_profiles['z']), 100))
+
     def test_vertical_mixing(self):
         # Export to file only at end
         o1 = PelagicEggDrift(loglevel=20)  # Profiles and vertical mixing
@@ -20,11 +20,13 @@
 import unittest
 from datetime import datetime, timedelta
 import netCDF4
+import numpy as np
 
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.models.pelagicegg import PelagicEggDrift
+from opendrift.models.oceandrift3D import OceanDrift3D
 
 try:
     netCDF4.Dataset('http://thredds.met.no/thredds/dodsC/sea/norkyst800m/1h/aggregate_be')
@@ -60,6 +62,108 @@ class TestRun(unittest.TestCase):
         self.assertAlmostEqual(o.elements.z.max(), -0.5, 3)
         self.assertAlmostEqual(o.elements.lon.max(), 14.871, 2)
 
+    def test_vertical_mixing_kernel(self):
+        z = {}
+        for fast_kernel, table_size in [(True, 0), (True, 1e7),
+                                        (False, 0)]:
+            np.random.seed(1)
+            o = OceanDrift3D(loglevel=50)
+            o.fallback_values['land_binary_mask'] = 0
+            o.fallback_values['x_wind'] = 10
+            o.fallback_values['sea_floor_depth_below_sea_level'] = 20
+            o.set_config('processes:turbulentmixing', True)
+            o.set_config('turbulentmixing:diffusivitymodel',
+                         'windspeed_Sundby1983')
+            o.set_config('turbulentmixing:fast_kernel', fast_kernel)
+            o.mixing_random_block_size = 1000
+            o.mixing_table_max_size = table_size
+            o.seed_elements(lon=4, lat=60, number=100, radius=100,
+                            z=-np.random.uniform(0, 30, 100),
+                            time=datetime(2016, 1, 1))
+            o.run(steps=2, time_step=900)
+            z[(fast_kernel, table_size)] = o.elements.z
+        # Same random numbers, thus same result as reference scheme,
+        # with profiles interpolated at each step or resampled once
+        np.testing.assert_array_equal(z[(True, 0)], z[(False, 0)])
+        np.testing.assert_array_equal(z[(True, 1e7)], z[(False, 0)])
+        self.assertTrue(z[(True, 1e7)].min() >= -20)
+        self.assertTrue(z[(True, 1e7)].max() <= 0)
+
+    def test_vertical_mixing_kernel_off_grid(self):
+        """K is interpolated for elements moved off the grid of half bins"""
+
+        class OffGridDrift(OceanDrift3D):
+            def surface_interaction(self, time_step_seconds=None):
+                super(OffGridDrift, self).surface_interaction(
+                    time_step_seconds)
+                shifted = (self.elements.ID % 7 == 0) & \
+                    (self.elements.z < -2) & (self.elements.z % 1 == 0)
+                self.elements.z[shifted] -= .3
+
+        z = {}
+        for fast_kernel in [True, False]:
+            np.random.seed(1)
+            o = OffGridDrift(loglevel=50)
+            o.fallback_values['land_binary_mask'] = 0
+            o.fallback_values['x_wind'] = 10
+            o.fallback_values['sea_floor_depth_below_sea_level'] = 50
+            o.set_config('processes:turbulentmixing', True)
+            o.set_config('turbulentmixing:diffusivitymodel',
+                         'stepfunction')
+            o.set_config('turbulentmixing:fast_kernel', fast_kernel)
+            o.mixing_random_block_size = 1000
+            o.seed_elements(lon=4, lat=60, number=100, radius=100,
+                            z=-np.random.uniform(10, 30, 100),
+                            time=datetime(2016, 1, 1))
+            o.run(steps=2, time_step=900)
+            z[fast_kernel] = o.elements.z
+        self.assertTrue(np.any(z[True] % .5 != 0))
+        np.testing.assert_array_equal(z[True], z[False])
+
+        # Also temperature and salinity profiles for terminal velocity
+        class OffGridEggDrift(PelagicEggDrift):
+            def prepare_vertical_mixing(self):
+                # Profiles with a thermo-/halocline, on levels which
+                # are not on the grid of half bins
+                profile_z = -np.array([0, 3.2, 10.2, 13.2, 16.2, 25.2,
+                                       40, 120])
+                num = self.num_elements_active()
+                ones = np.ones((len(profile_z), num))
+                self.environment_profiles = {
+                    'z': profile_z,
+                    'sea_water_temperature':
+                        (12 - 6*np.tanh(-profile_z - 15))[
+                            :, np.newaxis]*ones,
+                    'sea_water_salinity':
+                        (32 + 2*np.tanh(-profile_z - 15))[
+                            :, np.newaxis]*ones,
+                    'ocean_vertical_diffusivity': 0.002*ones}
+
+            def surface_interaction(self, time_step_seconds=None):
+                super(OffGridEggDrift, self).surface_interaction(
+                    time_step_seconds)
+                shifted = (self.elements.ID % 7 == 0) & \
+                    (self.elements.z < -2) & (self.elements.z % 1 == 0)
+                self.elements.z[shifted] -= .3
+
+        z = {}
+        for fast_kernel in [True, False]:
+            np.random.seed(1)
+            o = OffGridEggDrift(loglevel=50)
+            o.fallback_values['land_binary_mask'] = 0
+            o.set_config('processes:turbulentmixing', True)
+            o.set_config('turbulentmixing:fast_kernel', fast_kernel)
+            o.set_config('turbulentmixing:verticalresolution', 1)
+            o.set_config('turbulentmixing:timestep', 60)
+            o.mixing_random_block_size = 0
+            o.seed_elements(lon=4, lat=60, number=2000, radius=100,
+                            z=-np.random.uniform(8, 20, 2000),
+                            time=datetime(2016, 1, 1))
+            o.run(steps=2, time_step=900)
+            z[fast_kernel] = o.elements.z
+        self.assertTrue(np.any(z[True] % .5 != 0))
+        np.testing.assert_array_equal(z[True], z[False])
+
     @unittest.skipIf(thredds_support is False,
                      'NetCDF4 library does not support OPeNDAP')
     def atest_reader_boundary_thredds(self):